@@ -0,0 +1,572 @@
+#!/usr/bin/python
+# -*- coding: latin-1 -*-
+
+# Newer Credits Editor - Edits NewerSMBW's StaffRoll.bin
+# Version 1.3
+# Copyright (C) 2013-2017 RoadrunnerWMC
+
+# This file is part of Newer Credits Editor.
+
+# Newer Credits Editor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Newer Credits Editor is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Newer Credits Editor.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# benchmark.py
+# Times parsing, saving and the editor UI on synthetic StaffRoll.bin
+# files of various sizes, and writes the results as JSON.
+#
+# Usage: python3 benchmark.py [-o results.json] [--sizes 1000 10000 100000] [--no-gui]
+#
+# Exits with code 1 if the editor starts up too slowly, leaks memory or
+# uses too much of it per command (see --startup-budget, --leak-budget
+# and --command-bytes-budget).
+
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import staffroll
+
+
+########################################################################
+########################### Synthetic files ############################
+########################################################################
+
+FIRST_NAMES = ['Mario', 'Luigi', 'Peach', 'Daisy', 'Toad', 'Yoshi',
+    'Wario', 'Rosalina', 'Bowser', 'Kamek', 'Lakitu', 'Birdo']
+LAST_NAMES = ['Koopa', 'Goomba', 'Shyguy', 'Boo', 'Bob-omb', 'Chomp',
+    'Cheep', 'Blooper', 'Hammer', 'Thwomp', 'Wiggler', 'Pokey']
+ROLES = ['Programming', 'Level Design', 'Graphics', 'Music',
+    'Testing', 'Models', 'Tools', 'Special Thanks']
+
+# Number of commands in the file the editor is given on the command
+# line when timing how long it takes to start up
+STARTUP_FILE_SIZE = 10000
+
+
+def generateCommands(count, seed=0):
+    """
+    Return a list of about `count` commands that look like a real
+    credits script: blocks of Set Text / Show Text / Wait / Hide Text,
+    with occasional scene switches, logo animations and fireworks
+    """
+    rng = random.Random(seed)
+    coms = []
+
+    def add(comType, **values):
+        com = comType()
+        for attr, value in values.items():
+            setattr(com, attr, value)
+        coms.append(com)
+
+    add(staffroll.EnableEndingModeCommand)
+    add(staffroll.ShowScoresCommand)
+    while len(coms) < count - 1:
+        r = rng.random()
+        if r < 0.05:
+            add(rng.choice((staffroll.SwitchSceneCommand, staffroll.SwitchSceneAndWaitCommand)),
+                scene=rng.randrange(0x100))
+            add(staffroll.DelayCommand, delay=rng.randrange(30, 240))
+        elif r < 0.07:
+            add(staffroll.ShowTitleCommand)
+            add(staffroll.PlayTitleAnimationCommand, animation=rng.randrange(4))
+            add(staffroll.DelayCommand, delay=120)
+            add(staffroll.HideTitleCommand)
+        elif r < 0.08:
+            add(staffroll.BeginFireworksCommand)
+            add(staffroll.DelayCommand, delay=rng.randrange(60, 600))
+            add(staffroll.EndFireworksCommand)
+        else:
+            names = [f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+                for i in range(rng.randrange(1, 6))]
+            add(staffroll.SetTextCommand, title=rng.choice(ROLES), text='\n'.join(names))
+            add(staffroll.ShowTextCommand)
+            add(staffroll.DelayCommand, delay=rng.randrange(60, 300))
+            add(staffroll.HideTextCommand)
+            add(staffroll.DelayCommand, delay=rng.randrange(10, 60))
+    add(staffroll.EndCreditsCommand)
+
+    return coms
+
+
+def generateFile(count, seed=0):
+    """
+    Return the data of a synthetic StaffRoll.bin with about `count`
+    commands
+    """
+    f = staffroll.NewerStaffRollBin()
+    f.Commands = generateCommands(count, seed)
+    return f.save()
+
+
+########################################################################
+############################### Measuring ##############################
+########################################################################
+
+def measure(func, repeat):
+    """
+    Run func() `repeat` times and return the fastest time (in seconds)
+    and the peak memory allocated during one extra, traced run (in
+    bytes)
+    """
+    times = []
+    for i in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'seconds': min(times), 'peak_bytes': peak}
+
+
+def benchmarkFormat(data, repeat):
+    """
+    Benchmark parsing and saving
+    """
+    results = {}
+    f = staffroll.NewerStaffRollBin()
+
+    results['parse'] = measure(lambda: f._initFromData(data), repeat)
+
+    # Memory still held by the commands once they've been parsed
+    del f.Commands[:]
+    gc.collect()
+    tracemalloc.start()
+    f._initFromData(data)
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    results['bytes_per_command'] = held / max(len(f.Commands), 1)
+
+    # Saving from scratch has to encode every command
+    def coldSave():
+        for com in f.Commands: com._encoded = None
+        f.save()
+    results['save'] = measure(coldSave, repeat)
+
+    # Saving again after editing one command only has to re-encode that
+    # one
+    f.save()
+    delays = [com for com in f.Commands if isinstance(com, staffroll.DelayCommand)]
+    def editedSave():
+        delays[len(delays) // 2].delay += 1
+        f.save()
+    results['save_after_edit'] = measure(editedSave, repeat)
+
+    # Searching builds an index the first time, and uses it after that
+    def firstSearch():
+        staffroll.SearchIndex(f.Commands).find(FIRST_NAMES[0])
+    results['search_first'] = measure(firstSearch, repeat)
+    index = staffroll.SearchIndex(f.Commands)
+    index.find(FIRST_NAMES[0]) # builds it
+    def search():
+        index.find(f'{FIRST_NAMES[1]} {LAST_NAMES[1][:3]}')
+    results['search'] = measure(search, repeat)
+
+    # Checking for problems: the whole file, then again after an edit
+    results['lint'] = measure(lambda: staffroll.lintCommands(f.Commands), repeat)
+    lint = staffroll.LintResults(f.Commands)
+    def relint():
+        job = lint.nextJob()
+        lint.apply(job, staffroll.lintCommands(job.commands, job.states, job.dirty))
+    relint()
+    def lintAfterEdit():
+        lint.changed(len(f.Commands) // 2, len(f.Commands) // 2 + 1)
+        relint()
+    results['lint_after_edit'] = measure(lintAfterEdit, repeat)
+
+    return results
+
+
+def checkCommandTypes():
+    """
+    Return a list of messages about command types that would make every
+    command bigger than it needs to be: ones with a __dict__ (a subclass
+    missing __slots__), and field-less ones that aren't shared
+    """
+    problems = []
+    for opcode, cls in sorted(staffroll.CommandsById.items()):
+        com = cls()
+        if hasattr(com, '__dict__'):
+            problems.append(f'{cls.__name__} commands have a __dict__ (is __slots__ missing?)')
+        if not cls.fields and not (com is cls() is cls.fromData(b'')):
+            problems.append(f'{cls.__name__} commands have no fields, but aren\'t shared')
+    return problems
+
+
+def benchmarkGui(app, data, repeat):
+    """
+    Benchmark the editor's command list
+    """
+    import newer_credits_editor as nce
+
+    results = {}
+    view = nce.CreditsViewer()
+    view.show()
+    f = staffroll.NewerStaffRollBin(data)
+
+    def setFile():
+        view.setFile(f)
+        app.processEvents()
+    results['set_file'] = measure(setFile, repeat)
+
+    def updateNames():
+        view.updateNames()
+        app.processEvents()
+    results['update_names'] = measure(updateNames, repeat)
+
+    # What holding down the arrow key does: select each of the first 200
+    # commands in turn
+    steps = range(min(200, view.model.rowCount()))
+    def stepThrough():
+        for row in steps:
+            view.picker.setCurrentIndex(view.filterModel.index(row))
+            app.processEvents()
+    results['step_200_rows'] = measure(stepThrough, repeat)
+
+    # Type a search into the search bar, then clear it
+    def searchBar():
+        view.searchEdit.setText(FIRST_NAMES[2])
+        app.processEvents()
+        view.searchEdit.setText('')
+        app.processEvents()
+    results['search_bar'] = measure(searchBar, repeat)
+
+    # Type into the first Wait command's spinbox
+    row = next(i for i, com in enumerate(f.Commands) if isinstance(com, staffroll.DelayCommand))
+    view.picker.setCurrentIndex(view.filterModel.index(row))
+    app.processEvents()
+    def editCommand():
+        view.handleFieldEdit('delay', (f.Commands[row].delay + 1) & 0xFFFF)
+        app.processEvents()
+    results['edit_command'] = measure(editCommand, repeat)
+
+    # What a drag-and-drop does, minus the mouse: move the first tenth
+    # of the commands to the end
+    block = max(view.model.rowCount() // 10, 1)
+    def dragDrop():
+        view.selectRuns([(0, block)])
+        view.handleDragDrop(view.model.rowCount())
+        app.processEvents()
+    results['drag_drop'] = measure(dragDrop, repeat)
+
+    # Move that many commands down by one row
+    view.selectRuns([(0, block)])
+    def moveDown():
+        view.handleShift(1)
+        app.processEvents()
+    results['move_down'] = measure(moveDown, repeat)
+
+    # Add a 500-name credits block in the middle through the Add
+    # dialog (without showing it), then undo that
+    palette = view.commandPalette = nce.CommandPalette(view)
+    palette.edit.setText('set text, show text, wait, hide text, wait * 500')
+    palette.exec_ = lambda: palette.Accepted
+    def addBlock():
+        view.selectRuns([(view.model.rowCount() // 2, 1)])
+        view.handleAdd()
+        app.processEvents()
+        view.undoStack.undo()
+        app.processEvents()
+    results['add_500_credits'] = measure(addBlock, repeat)
+
+    results['leaked_bytes'] = measureLeak(app, view, data)
+
+    view.close()
+    view.deleteLater()
+    app.processEvents()
+    return results
+
+
+def benchmarkTabs(app, size, seed, repeat, tabs=12):
+    """
+    Benchmark switching between several big files open in tabs, and
+    opening one again after closing it
+    """
+    import newer_credits_editor as nce
+
+    results = {}
+    window = nce.MainWindow()
+    with tempfile.TemporaryDirectory() as folder:
+        paths = []
+        for i in range(tabs):
+            paths.append(os.path.join(folder, f'StaffRoll{i}.bin'))
+            with open(paths[-1], 'wb') as f:
+                f.write(generateFile(size, seed + i))
+
+        def waitForLoading():
+            while any(doc.loader is not None for doc in window.documents()):
+                app.processEvents()
+
+        for path in paths: window.loadFile(path)
+        waitForLoading()
+
+        def switchTabs():
+            for i in range(tabs):
+                window.tabs.setCurrentIndex(i)
+                app.processEvents()
+        results[f'switch_{tabs}_tabs'] = measure(switchTabs, repeat)
+
+        # The file is still in the parse cache after its tab is closed
+        def reopen():
+            window.closeDocument(window.doc)
+            window.loadFile(paths[0])
+            waitForLoading()
+            app.processEvents()
+        results['reopen_cached_file'] = measure(reopen, repeat)
+
+        window.close()
+    window.deleteLater()
+    app.processEvents()
+    return results
+
+
+# Run in a new Python process by benchmarkStartup(), with the path of a
+# file to open. Prints "painted" when the window is first painted, and
+# "loaded" (then quits) once the file has finished loading.
+StartupScript = """
+import sys
+import newer_credits_editor as nce # first, so its time includes PyQt's
+from PyQt5 import QtCore, QtWidgets
+
+app = QtWidgets.QApplication(sys.argv[:1])
+state = {'painted': False}
+
+class PaintWatcher(QtCore.QObject):
+    def eventFilter(self, obj, event):
+        if event.type() == QtCore.QEvent.Paint and not state['painted']:
+            state['painted'] = True
+            print('painted', flush=True)
+        return False
+watcher = PaintWatcher()
+app.installEventFilter(watcher)
+
+window = nce.MainWindow(sys.argv[1:])
+
+def checkLoaded():
+    if state['painted'] and window.doc is not None and window.doc.loader is None:
+        print('loaded', flush=True)
+        app.quit()
+timer = QtCore.QTimer()
+timer.timeout.connect(checkLoaded)
+timer.start(1)
+app.exec_()
+"""
+
+
+def benchmarkStartup(size, seed, repeat):
+    """
+    Benchmark starting the editor in a new process with a file to open:
+    how long until its window is first painted and the file has
+    loaded, and how long its imports take (from python -X importtime)
+    """
+    times = {'painted': [], 'loaded': [], 'imports': []}
+    env = dict(os.environ)
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'StaffRoll.bin')
+        with open(path, 'wb') as f:
+            f.write(generateFile(size, seed))
+
+        for i in range(repeat):
+            # The import times go to stderr, which is written to a file
+            # so it can't fill up a pipe while stdout is being read
+            with open(os.path.join(folder, 'importtime.txt'), 'w+b') as err:
+                start = time.perf_counter()
+                proc = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', StartupScript, path],
+                    stdout=subprocess.PIPE, stderr=err, env=env,
+                    cwd=os.path.dirname(os.path.abspath(__file__)))
+                seen = set()
+                for line in proc.stdout:
+                    event = line.decode('ascii', 'replace').strip()
+                    if event in times:
+                        times[event].append(time.perf_counter() - start)
+                        seen.add(event)
+                proc.wait()
+
+                err.seek(0)
+                imports = parseImportTimes(err.read().decode('utf-8', 'replace'))
+            if seen != {'painted', 'loaded'}:
+                raise RuntimeError(f'the editor exited with code {proc.returncode} before starting up')
+            times['imports'].append(imports['newer_credits_editor'][1])
+
+    # Modules that took longest to import themselves, on the last run
+    slowest = sorted(imports.items(), key=lambda item: item[1][0], reverse=True)[:8]
+    return {
+        'startup_first_paint': {'seconds': min(times['painted'])},
+        'startup_file_loaded': {'seconds': min(times['loaded']), 'commands': size},
+        'startup_imports': {'seconds': min(times['imports'])},
+        'slowest_imports': {name: selfTime for name, (selfTime, total) in slowest},
+        }
+
+
+def parseImportTimes(text):
+    """
+    Return {module name: (seconds importing it alone, seconds including
+    what it imported)} from python -X importtime's output
+    """
+    imports = {}
+    for line in text.splitlines():
+        if not line.startswith('import time:'): continue
+        selfTime, total, name = line[len('import time:'):].split('|')
+        if not selfTime.strip().isdigit(): continue # the heading
+        imports[name.strip()] = (int(selfTime) / 1e6, int(total) / 1e6)
+    return imports
+
+
+def measureLeak(app, view, data, cycles=10):
+    """
+    Repeatedly open a file, select some commands and remove some, and
+    return how much memory is still held afterward compared to after
+    the first few cycles. This should stay near zero.
+    """
+    from PyQt5 import QtCore
+
+    def settle():
+        # Let lint jobs finish first: a running one holds a copy of the
+        # commands it's checking, which would look like a leak the size
+        # of the file. Each one finishing can start another.
+        while True:
+            QtCore.QThreadPool.globalInstance().waitForDone()
+            app.processEvents()
+            if view.lintWorker is None: break
+        app.sendPostedEvents(None, QtCore.QEvent.DeferredDelete)
+        gc.collect()
+
+    def cycle():
+        view.setFile(staffroll.NewerStaffRollBin(data))
+        for row in range(min(50, view.model.rowCount())):
+            view.picker.setCurrentIndex(view.filterModel.index(row))
+        for i in range(min(20, view.model.rowCount())):
+            view.picker.setCurrentIndex(view.filterModel.index(0))
+            view.handleRemove()
+        app.sendPostedEvents(None, QtCore.QEvent.DeferredDelete)
+        app.processEvents()
+
+    for i in range(3): cycle() # warm up
+    settle()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    for i in range(cycles): cycle()
+    view.setFile(None)
+    settle()
+    leaked = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    return leaked
+
+
+########################################################################
+################################# main #################################
+########################################################################
+
+def gitRevision():
+    """
+    Return the current git commit hash, or None if it can't be found
+    """
+    try:
+        proc = subprocess.run(['git', 'rev-parse', 'HEAD'],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return proc.stdout.decode('ascii').strip() or None
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark Newer Credits Editor.')
+    parser.add_argument('-o', '--output', default='-', help="file to write JSON results to ('-' for stdout)")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='numbers of commands to test with')
+    parser.add_argument('--repeat', type=int, default=5, help='number of times to time each operation')
+    parser.add_argument('--seed', type=int, default=0, help='seed for generating the synthetic files')
+    parser.add_argument('--no-gui', action='store_true', help="don't benchmark the editor UI")
+    parser.add_argument('--startup-budget', type=float, default=1.0,
+        help='fail if the editor takes longer than this many seconds to first paint its window (default: %(default)s)')
+    parser.add_argument('--command-bytes-budget', type=float, default=80,
+        help='fail if parsed files take more than this many bytes of memory per command (default: %(default)s)')
+    parser.add_argument('--leak-budget', type=int, default=64 * 1024,
+        help='fail if opening a file and removing commands over and over leaves more than this many bytes allocated (default: %(default)s)')
+    args = parser.parse_args(argv[1:])
+
+    app = None
+    if not args.no_gui:
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        try:
+            from PyQt5 import QtWidgets
+        except ImportError:
+            print('>> PyQt5 not found; skipping UI benchmarks', file=sys.stderr)
+        else:
+            app = QtWidgets.QApplication(argv)
+
+    results = {
+        'revision': gitRevision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'sizes': {},
+        }
+
+    overBudget = False
+    if app is not None:
+        print('>> startup...', file=sys.stderr)
+        results['startup'] = benchmarkStartup(STARTUP_FILE_SIZE, args.seed, args.repeat)
+        firstPaint = results['startup']['startup_first_paint']['seconds']
+        if firstPaint > args.startup_budget:
+            print(f'>> the editor took {firstPaint:.3f} s to start up, over the budget of {args.startup_budget} s', file=sys.stderr)
+            overBudget = True
+
+    for problem in checkCommandTypes():
+        print(f'>> {problem}', file=sys.stderr)
+        overBudget = True
+
+    for size in args.sizes:
+        print(f'>> {size} commands...', file=sys.stderr)
+        data = generateFile(size, args.seed)
+        r = {'commands': len(staffroll.NewerStaffRollBin(data).Commands), 'bytes': len(data)}
+        r.update(benchmarkFormat(data, args.repeat))
+        if r['bytes_per_command'] > args.command_bytes_budget:
+            print(f'>> parsed commands take {r["bytes_per_command"]:.1f} bytes each with {size} commands, '
+                f'over the budget of {args.command_bytes_budget}', file=sys.stderr)
+            overBudget = True
+        if app is not None:
+            r.update(benchmarkGui(app, data, args.repeat))
+            if r['leaked_bytes'] > args.leak_budget:
+                print(f'>> {r["leaked_bytes"]} bytes were leaked with {size} commands, over the budget of {args.leak_budget}', file=sys.stderr)
+                overBudget = True
+            r.update(benchmarkTabs(app, size, args.seed, args.repeat))
+        results['sizes'][str(size)] = r
+
+    out = json.dumps(results, indent=2)
+    if args.output == '-':
+        print(out)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(out + '\n')
+
+    return 1 if overBudget else 0
+
+if __name__ == '__main__': sys.exit(main(sys.argv))
@@ -123,7 +123,7 @@ print('>> Populating excludes and includes...')
 print('>>')
 
 # Excludes
-excludes = ['calendar', 'datetime', 'difflib', 'doctest', 'hashlib', 'inspect',
+excludes = ['calendar', 'datetime', 'difflib', 'doctest', 'inspect',
     'locale', 'multiprocessing', 'optpath', 'os2emxpath', 'pdb',
     'socket', 'ssl', 'unittest',
     'FixTk', 'tcl', 'tk', '_tkinter', 'tkinter', 'Tkinter']
@@ -0,0 +1,312 @@
+#!/usr/bin/python
+# -*- coding: latin-1 -*-
+
+# Newer Credits Editor - Edits NewerSMBW's StaffRoll.bin
+# Version 1.3
+# Copyright (C) 2013-2017 RoadrunnerWMC
+
+# This file is part of Newer Credits Editor.
+
+# Newer Credits Editor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Newer Credits Editor is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Newer Credits Editor.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# fuzz.py
+# Checks staffroll.py's StaffRoll.bin reader and writer against random
+# input: random command lists have to survive a save/load round trip,
+# and random or damaged files have to either load (and then save
+# consistently) or be rejected with a ValueError or IndexError (as
+# the editor and staffroll.py's tools expect). Failures are shrunk
+# to a small example before being reported. Also reports how fast
+# parsing went, so a faster parser can be checked against this before
+# it replaces the current one.
+#
+# Usage: python3 fuzz.py [--seconds 10] [--seed 0] [-o results.json]
+
+
+import argparse
+import json
+import random
+import sys
+import time
+import traceback
+
+import staffroll
+
+
+########################################################################
+############################ Random commands ###########################
+########################################################################
+
+def textAlphabet():
+    """
+    Return a string of every (non-null) character below U+3000 that can
+    be encoded in staffroll.TextEncoding and decodes back to itself
+    (Shift-JIS, for one, encodes both '~' and U+203E as 0x7E)
+    """
+    chars = []
+    for i in range(1, 0x3000):
+        try:
+            if chr(i).encode(staffroll.TextEncoding).decode(staffroll.TextEncoding) != chr(i):
+                continue
+        except UnicodeError:
+            continue
+        chars.append(chr(i))
+    return ''.join(chars)
+
+
+def randomString(rng, alphabet, maxBytes, newlines):
+    """
+    Return a random string that encodes to at most maxBytes bytes
+    """
+    length = rng.choice((0, 1, rng.randrange(maxBytes + 1)))
+    chars = []
+    size = 0
+    while len(chars) < length:
+        c = '\n' if newlines and rng.random() < 0.1 else rng.choice(alphabet)
+        size += len(c.encode(staffroll.TextEncoding))
+        if size > maxBytes: break
+        chars.append(c)
+    return ''.join(chars)
+
+
+def randomCommand(rng, alphabet):
+    """
+    Return a random command of any type, with random values that can
+    all be saved
+    """
+    com = rng.choice(list(staffroll.CommandsById.values()))()
+
+    # The whole record has to fit in 255 bytes. With every string empty,
+    # it's just the length byte, opcode, fixed-size values and the
+    # strings' null terminators, and the strings share the rest.
+    room = 0xFF - 2 - len(com.asData())
+    for attr, label, kind in com.fields:
+        if kind.isString:
+            value = randomString(rng, alphabet, rng.randrange(room + 1), kind.multiline)
+            room -= len(value.encode(staffroll.TextEncoding))
+        else:
+            value = rng.choice((0, kind.maximum, rng.randrange(kind.maximum + 1)))
+        setattr(com, attr, value)
+    return com
+
+
+def randomCommands(rng, alphabet):
+    """
+    Return a random list of commands. Most are short, some are long.
+    """
+    count = rng.choice((0, 1, rng.randrange(20), rng.randrange(2000)))
+    return [randomCommand(rng, alphabet) for i in range(count)]
+
+
+########################################################################
+############################## Properties ##############################
+########################################################################
+
+def makeFile(coms):
+    f = staffroll.NewerStaffRollBin()
+    f.Commands = list(coms)
+    return f
+
+
+def freshCopy(com):
+    """
+    Return a new copy of a command, built without any cached encoding
+    """
+    return staffroll.commandFromDict(json.loads(json.dumps(staffroll.commandAsDict(com))))
+
+
+def checkRoundTrip(coms, rng, alphabet):
+    """
+    Check that a list of commands survives being saved and loaded.
+    Returns a message describing the first problem, or None.
+    """
+    data = makeFile(coms).save()
+    loaded = staffroll.NewerStaffRollBin(data)
+    if loaded.save() != data:
+        return 'saving a loaded file gave different data'
+    if [staffroll.commandAsDict(c) for c in loaded.Commands] != [staffroll.commandAsDict(c) for c in coms]:
+        return 'loading a saved file gave different commands'
+    if makeFile([freshCopy(c) for c in coms]).save() != data:
+        return 'commands copied through JSON saved differently'
+
+    # Change some fields, and make sure no stale cached encodings are
+    # saved
+    for com in rng.sample(loaded.Commands, min(5, len(loaded.Commands))):
+        other = randomCommand(rng, alphabet)
+        if type(other) is not type(com): continue
+        for attr, label, kind in com.fields:
+            setattr(com, attr, getattr(other, attr))
+    if loaded.save() != makeFile([freshCopy(c) for c in loaded.Commands]).save():
+        return 'saving after editing commands gave stale data'
+
+    return None
+
+
+def checkRawBytes(data):
+    """
+    Check that some arbitrary data either loads, and then saves to
+    something that loads and saves the same way, or is rejected with a
+    ValueError or IndexError. Returns (a message describing the first
+    problem or None, whether the data loaded).
+    """
+    try:
+        f = staffroll.NewerStaffRollBin(data)
+    except (ValueError, IndexError):
+        return None, False
+    except Exception:
+        return 'loading raised ' + traceback.format_exc().strip().splitlines()[-1], False
+
+    try:
+        saved = f.save()
+        if staffroll.NewerStaffRollBin(saved).save() != saved:
+            return 'saving a loaded file twice gave different data', True
+    except Exception:
+        return 'saving a loaded file raised ' + traceback.format_exc().strip().splitlines()[-1], True
+    return None, True
+
+
+def mutate(rng, data):
+    """
+    Return a randomly damaged copy of some file data
+    """
+    data = bytearray(data)
+    for i in range(rng.randint(1, 4)):
+        r = rng.random()
+        pos = rng.randrange(len(data) + 1)
+        if r < 0.3 and data:
+            data[min(pos, len(data) - 1)] ^= 1 << rng.randrange(8)
+        elif r < 0.5 and data:
+            data[min(pos, len(data) - 1)] = rng.choice((0, 1, 2, 0xFF, rng.randrange(0x100)))
+        elif r < 0.65:
+            del data[pos:pos + rng.randint(1, 8)]
+        elif r < 0.8:
+            data[pos:pos] = bytes(rng.randrange(0x100) for i in range(rng.randint(1, 8)))
+        elif r < 0.9:
+            del data[pos:]
+        else:
+            other = rng.randrange(len(data) + 1)
+            data[pos:pos] = data[other:other + rng.randint(1, 32)]
+    return bytes(data)
+
+
+def shrink(items, fails):
+    """
+    Return as small a part of items (a list or bytes) as can be found
+    by removing chunks of it, for which fails() is still true
+    """
+    chunk = len(items) // 2
+    while chunk:
+        i = 0
+        while i < len(items):
+            candidate = items[:i] + items[i + chunk:]
+            if fails(candidate):
+                items = candidate
+            else:
+                i += chunk
+        chunk //= 2
+    return items
+
+
+########################################################################
+################################# main #################################
+########################################################################
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Fuzz the StaffRoll.bin reader and writer.')
+    parser.add_argument('--seconds', type=float, default=10, help='how long to run for')
+    parser.add_argument('--seed', type=int, help='random seed (default: a new one each run)')
+    parser.add_argument('--encoding', default=staffroll.TextEncoding,
+        help=f'encoding of Set Text titles and text (default: {staffroll.TextEncoding})')
+    parser.add_argument('-o', '--output', help='file to also write JSON results to')
+    args = parser.parse_args(argv[1:])
+
+    try:
+        staffroll.setTextEncoding(args.encoding)
+    except LookupError:
+        parser.error(f'unknown encoding: {args.encoding}')
+    alphabet = textAlphabet()
+
+    seed = random.randrange(1 << 32) if args.seed is None else args.seed
+    print(f'>> seed {seed}', file=sys.stderr)
+    rng = random.Random(seed)
+
+    results = {
+        'seed': seed,
+        'encoding': staffroll.TextEncoding,
+        'round_trip': {'files': 0, 'commands': 0, 'failures': 0},
+        'raw_bytes': {'inputs': 0, 'loaded': 0, 'rejected': 0, 'failures': 0},
+        }
+    parseBytes = parseCommands = 0
+    parseTime = 0.0
+    failures = []
+
+    end = time.perf_counter() + args.seconds
+    while time.perf_counter() < end and len(failures) < 10:
+        # Round trip of random commands
+        coms = randomCommands(rng, alphabet)
+        caseSeed = rng.randrange(1 << 32)
+        message = checkRoundTrip(coms, random.Random(caseSeed), alphabet)
+        results['round_trip']['files'] += 1
+        results['round_trip']['commands'] += len(coms)
+        if message:
+            results['round_trip']['failures'] += 1
+            small = shrink(coms, lambda c: checkRoundTrip(c, random.Random(caseSeed), alphabet) is not None)
+            failures.append((f'round trip: {checkRoundTrip(small, random.Random(caseSeed), alphabet)}',
+                '\n'.join(json.dumps(staffroll.commandAsDict(c), ensure_ascii=False) for c in small)))
+
+        # Parsing speed, on the file that was just made
+        data = makeFile(coms).save()
+        start = time.perf_counter()
+        staffroll.NewerStaffRollBin(data)
+        parseTime += time.perf_counter() - start
+        parseBytes += len(data)
+        parseCommands += len(coms)
+
+        # Random and damaged data
+        for i in range(10):
+            if rng.random() < 0.2:
+                raw = bytes(rng.randrange(0x100) for i in range(rng.randrange(64)))
+            else:
+                raw = mutate(rng, data)
+            message, loaded = checkRawBytes(raw)
+            r = results['raw_bytes']
+            r['inputs'] += 1
+            r['loaded' if loaded else 'rejected'] += 1
+            if message:
+                r['failures'] += 1
+                small = shrink(raw, lambda d: checkRawBytes(d)[0] is not None)
+                failures.append((f'raw bytes: {checkRawBytes(small)[0]}', small.hex()))
+
+    results['parse'] = {
+        'bytes_per_second': parseBytes / parseTime if parseTime else None,
+        'commands_per_second': parseCommands / parseTime if parseTime else None,
+        }
+
+    r = results['round_trip']
+    print(f'round trip: {r["files"]} files, {r["commands"]} commands, {r["failures"]} failures')
+    r = results['raw_bytes']
+    print(f'raw bytes:  {r["inputs"]} inputs ({r["loaded"]} loaded, {r["rejected"]} rejected), {r["failures"]} failures')
+    if parseTime:
+        print(f'parsing:    {parseBytes / parseTime / 1e6:.1f} MB/s, {parseCommands / parseTime:,.0f} commands/s')
+    for message, example in failures:
+        print(f'\nFAILED {message}\n{example}')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(results, indent=2) + '\n')
+
+    return 1 if failures else 0
+
+if __name__ == '__main__': sys.exit(main(sys.argv))
@@ -32,563 +32,702 @@
 
 version = '1.3'
 
+# Maximum number of steps kept on each file's undo stack
+UndoLimit = 1000
+
+# Roughly how much memory the cache of parsed files can use. Files stay
+# in it after they're closed, so opening them again doesn't parse them.
+ParseCacheLimit = 256 * 1024 * 1024
+
+# Clipboard format for copied commands: their encoded records,
+# followed by a null command, just like a StaffRoll.bin
+CommandsMimeType = 'application/x-newer-staffroll-commands'
+
+import bisect
+import html
+import os.path
 import sys
-import uuid
 
 from PyQt5 import QtCore, QtGui, QtWidgets; Qt = QtCore.Qt
 
+from staffroll import CommandTypeIndex, CommandsById, LintResults, NewerStaffRollBin, ParseCache, SearchIndex, Timeline, describeCommand, formatFrames, iterCommands, lintCommands, mapFile, writeFileAtomically
+
 
 
 
 ################################################################
 ################################################################
 ################################################################
-########################### Commands ###########################
+######################### UI Classes ###########################
 
 
-class Command():
+class CommandListModel(QtCore.QAbstractListModel):
     """
-    Base class for all commands
+    Model that presents the commands in a file to a list view. Names and
+    tooltips are generated from the commands only when the view asks
+    for them, so only the visible rows cost anything.
     """
-    name = ''
-    description = ''
-    dynamicDescription = None
+    MinimumTimeNote = ('Times from here on are minimums: Switch Scene and Wait '
+        'waits for the scene transition to finish, which isn\'t counted.')
 
-    def __init__(self):
-        self.widgets = []
-        self.layout = QtWidgets.QVBoxLayout()
-        self.uuid = uuid.uuid4()
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.file = None
+        self.timeline = Timeline([])
+        self.searchIndex = SearchIndex([])
+        self.lint = LintResults([])
+        self.lintIcon = None
 
-    @classmethod
-    def fromData(cls, data):
+    def setFile(self, file):
         """
-        Create a Command instance based on some data
+        Change the file whose commands are shown
         """
-        return cls()
+        self.beginResetModel()
+        self.file = file
+        self.timeline = Timeline([] if file is None else file.Commands)
+        self.searchIndex = SearchIndex([] if file is None else file.Commands)
+        self.lint = LintResults([] if file is None else file.Commands)
+        self.endResetModel()
 
-    def asData(self):
+    def commandAt(self, row):
         """
-        Return data based on current settings
+        Return the command in the given row
         """
-        return ()
-
-    def generateLayout(self):
+        return self.file.Commands[row]
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid() or self.file is None: return 0
+        return len(self.file.Commands)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid(): return None
+        com = self.file.Commands[index.row()]
+
+        if role == Qt.DisplayRole:
+            # Times after a Switch Scene and Wait are only minimums,
+            # marked with a +
+            time = formatFrames(self.timeline.startFrame(index.row()))
+            if self.timeline.isMinimum(index.row()): time += '+'
+            return f'{time}   {describeCommand(com)}'
+        elif role == Qt.ToolTipRole:
+            tip = f'<b>{com.name}:</b><br>{com.description}'
+            if self.timeline.isMinimum(index.row()):
+                tip += f'<br><i>{self.MinimumTimeNote}</i>'
+            for message in self.lint.issues.get(index.row(), ()):
+                tip += f'<br><font color="red">{html.escape(message)}</font>'
+            return tip
+        elif role == Qt.DecorationRole and index.row() in self.lint.issues:
+            if self.lintIcon is None:
+                self.lintIcon = QtWidgets.QApplication.style().standardIcon(QtWidgets.QStyle.SP_MessageBoxWarning)
+            return self.lintIcon
+
+    def flags(self, index):
+        if not index.isValid(): return Qt.ItemIsDropEnabled
+        return Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsDragEnabled
+
+    def supportedDropActions(self):
+        return Qt.MoveAction
+
+    def mimeTypes(self):
+        return [CommandsMimeType]
+
+    def mimeData(self, indexes):
+        # Drops are handled by the view from its selection, so there's
+        # no need to encode every dragged row here
+        data = QtCore.QMimeData()
+        data.setData(CommandsMimeType, QtCore.QByteArray())
+        return data
+
+    def insertCommands(self, row, coms):
         """
-        Create a layout from self.widgets
+        Insert some commands before the given row
         """
-        if len(self.widgets) > 0:
-            L = QtWidgets.QFormLayout()
-            for name, W in self.widgets:
-                L.addRow(name, W)
-            self.layout = L
-        else: self.layout = getNullLayout()
-
-
-class DelayCommand(Command):
-    """
-    Command which indicates a delay
-    """
-    name = 'Wait'
-    description = 'Causes a delay before the next command is processed.'
-
-    def __init__(self):
-        super().__init__()
-
-        W = QtWidgets.QSpinBox()
-        W.setMaximum(0xFFFF)
-        self.widgets = []
-        self.widgets.append(('Time (in frames):', W))
-        self.generateLayout()
-
-    @classmethod
-    def fromData(cls, data):
-        cmd = cls()
-        delay = (data[0] << 8) | data[1]
-        cmd.widgets[0][1].setValue(delay)
-        return cmd
-
-    def asData(self):
-        delay = self.widgets[0][1].value()
-        a = (delay >> 8) & 0xFF
-        b = delay & 0xFF
-        return (a, b)
-
-    @property
-    def dynamicDescription(self):
-        n = self.widgets[0][1].value()
-        return 'for 1 frame' if n == 1 else f'for {n} frames'
-
-
-class SwitchSceneCommand(Command):
-    """
-    Command which indicates a scene switch
-    """
-    name = 'Switch Scene'
-    description = 'Causes the level to switch to another zone.'
-
-    def __init__(self):
-        super().__init__()
-
-        W = QtWidgets.QSpinBox()
-        W.setMaximum(0xFF)
-        self.widgets = []
-        self.widgets.append(('Scene ID:', W))
-        self.generateLayout()
-
-    @classmethod
-    def fromData(cls, data):
-        cmd = cls()
-        cmd.widgets[0][1].setValue(data[0])
-        return cmd
-
-    def asData(self):
-        L = []
-        L.append(self.widgets[0][1].value())
-        return L
-
-    @property
-    def dynamicDescription(self):
-        return f'to Scene ID {self.widgets[0][1].value()}'
-
-
-class SwitchSceneAndWaitCommand(SwitchSceneCommand):
-    """
-    Command which indicates a scene switch and then wait
-    """
-    name = 'Switch Scene and Wait'
-    description = 'Causes the level to switch to another zone and then wait.'
-
-
-class ShowScoresCommand(Command):
-    """
-    Command which causes the scores to be displayed
-    """
-    name = 'Show Coin Counters'
-    description = 'Causes the coin counters to become visible.'
-
-    def __init__(self):
-        super().__init__()
-        self.generateLayout()
-
+        if not coms: return
+        self.beginInsertRows(QtCore.QModelIndex(), row, row + len(coms) - 1)
+        self.file.Commands[row:row] = coms
+        self.timeline.invalidate()
+        self.searchIndex.add(coms)
+        self.lint.inserted(row, len(coms))
+        self.endInsertRows()
+
+    def appendCommands(self, coms):
+        """
+        Add some commands to the end of the file
+        """
+        self.insertCommands(self.rowCount(), coms)
 
-class ShowTextCommand(Command):
-    """
-    Command which causes the current text to be displayed
-    """
-    name = 'Show Text'
-    description = 'Causes the current text to fade onto the screen.'
+    def removeCommands(self, row, count):
+        """
+        Remove `count` commands, starting at the given row
+        """
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row + count - 1)
+        self.searchIndex.remove(self.file.Commands[row:row + count])
+        del self.file.Commands[row:row + count]
+        self.timeline.invalidate()
+        self.lint.removed(row, count)
+        self.endRemoveRows()
+
+    def moveRows(self, sourceParent, sourceRow, count, destinationParent, destinationChild):
+        last = sourceRow + count - 1
+        if not self.beginMoveRows(sourceParent, sourceRow, last, destinationParent, destinationChild):
+            return False
+
+        # Only the moved rows and the ones they jumped over change places
+        if destinationChild > sourceRow:
+            start, end = sourceRow, destinationChild
+        else:
+            start, end = destinationChild, last + 1
+
+        coms = self.file.Commands
+        moved = coms[sourceRow:last + 1]
+        del coms[sourceRow:last + 1]
+        if destinationChild > sourceRow: destinationChild -= count
+        coms[destinationChild:destinationChild] = moved
+        self.timeline.reorder(start, end)
+        self.lint.changed(start, end)
+
+        self.endMoveRows()
+        return True
+
+    def replaceCommand(self, row, com):
+        """
+        Replace the command in the given row with another one
+        """
+        self.searchIndex.remove([self.file.Commands[row]])
+        self.file.Commands[row] = com
+        self.searchIndex.add([com])
+        self.lint.changed(row, row + 1)
 
-    def __init__(self):
-        super().__init__()
-        self.generateLayout()
+        # If its duration changed, so did the times of every command
+        # after it
+        last = self.rowCount() - 1 if self.timeline.update(row) else row
+        self.dataChanged.emit(self.index(row), self.index(last), [Qt.DisplayRole])
 
+    def updateNames(self):
+        """
+        Tell views that every row's name may have changed
+        """
+        if self.rowCount():
+            self.dataChanged.emit(self.index(0), self.index(self.rowCount() - 1), [Qt.DisplayRole])
 
-class HideTextCommand(Command):
-    """
-    Command which causes the current text to be hidden
-    """
-    name = 'Hide Text'
-    description = 'Causes the current text to fade out.'
+    def applyLint(self, job, result):
+        """
+        Store the result of a lint job, and tell views which rows'
+        problems may have changed
+        """
+        span = self.lint.apply(job, result)
+        if span is None or span[0] == span[1]: return
+        roles = [Qt.DecorationRole, Qt.ToolTipRole]
+        self.dataChanged.emit(self.index(span[0]), self.index(span[1] - 1), roles)
 
-    def __init__(self):
-        super().__init__()
-        self.generateLayout()
+    def search(self, query):
+        """
+        Return the sorted rows of the Set Text commands matching a
+        search, or None if it doesn't have any words in it
+        """
+        return self.searchIndex.find(query)
 
 
-class SetTextCommand(Command):
+class CommandFilterModel(QtCore.QAbstractProxyModel):
     """
-    Command which sets the current text
+    Proxy model that shows only the rows of a CommandListModel that
+    match a search, without copying anything but their row numbers.
+    With no search, every row (and every change) is passed straight
+    through. While searching, the rows shown are only worked out again
+    when the search or the set of rows changes, so a command that's
+    edited so that it no longer matches doesn't vanish from under you.
     """
-    name = 'Set Text'
-    description = 'Changes the current text.'
-
-    def __init__(self):
-        super().__init__()
-
-        W = QtWidgets.QLineEdit()
-        X = QtWidgets.QPlainTextEdit()
-        X.setLineWrapMode(X.NoWrap)
-        self.widgets = (('Title:', W), ('Text:', X))
-        self.generateLayout()
-
-    @classmethod
-    def fromData(cls, data):
-
-        LenOfTitle = data[0]
-        NumOfLines = data[1]
-
-        title = ''
-        i = 2
-        while i < LenOfTitle + 2:
-            title += chr(data[i])
-            i += 1
-        title = title[:-1] # ?
-
-        text = ''
-        while True:
-            if data[i] != 0: text += chr(data[i])
-            else: break
-            i += 1
-
-        cmd = cls()
-        cmd.widgets[0][1].setText(title)
-        cmd.widgets[1][1].setPlainText(text)
-        return cmd
-
-    def asData(self):
-        new = []
-        title = str(self.widgets[0][1].text())
-        text = str(self.widgets[1][1].toPlainText())
-
-        new.append(len(title)+1)
-        new.append(text.count('\n')+1)
-
-        for char in title:
-            if char != chr(0): new.append(ord(char))
-        new.append(0)
-        for char in text:
-            if char != chr(0): new.append(ord(char))
-        new.append(0)
-
-        return tuple(new)
-
-    @property
-    def dynamicDescription(self):
-        return f'to "{self.widgets[0][1].text()}"'
+    def __init__(self, source, parent=None):
+        super().__init__(parent)
+        self.query = ''
+        self.rows = None # sorted source rows to show, or None for all of them
+        self.setSourceModel(source)
+
+        root = QtCore.QModelIndex()
+        source.modelAboutToBeReset.connect(self.beginResetModel)
+        source.modelReset.connect(lambda: self.sourceChanged(self.endResetModel, True))
+        source.rowsAboutToBeInserted.connect(lambda parent, first, last:
+            self.sourceAboutToChange(self.beginInsertRows, root, first, last))
+        source.rowsInserted.connect(lambda: self.sourceChanged(self.endInsertRows))
+        source.rowsAboutToBeRemoved.connect(lambda parent, first, last:
+            self.sourceAboutToChange(self.beginRemoveRows, root, first, last))
+        source.rowsRemoved.connect(lambda: self.sourceChanged(self.endRemoveRows))
+        source.rowsAboutToBeMoved.connect(lambda parent, first, last, destParent, dest:
+            self.sourceAboutToChange(self.beginMoveRows, root, first, last, root, dest))
+        source.rowsMoved.connect(lambda: self.sourceChanged(self.endMoveRows))
+        source.dataChanged.connect(self.handleSourceDataChanged)
+
+    def setQuery(self, query):
+        """
+        Show only the commands matching a search (or all of them, if it
+        has no words in it)
+        """
+        self.beginResetModel()
+        self.query = query
+        self.rows = self.sourceModel().search(query)
+        self.endResetModel()
+
+    def sourceAboutToChange(self, begin, *args):
+        if self.rows is None: begin(*args)
+        else: self.beginResetModel()
+
+    def sourceChanged(self, end, reset=False):
+        if self.rows is None and not reset:
+            end()
+        else:
+            self.rows = self.sourceModel().search(self.query)
+            self.endResetModel()
+
+    def handleSourceDataChanged(self, topLeft, bottomRight, roles=()):
+        first, last = self.proxyRange(topLeft.row(), bottomRight.row())
+        if first <= last:
+            self.dataChanged.emit(self.index(first), self.index(last), roles)
+
+    def sourceRow(self, row):
+        """
+        Return the source row shown in the given row
+        """
+        return row if self.rows is None else self.rows[row]
 
+    def sourceRuns(self, first, last):
+        """
+        Return the source rows shown in rows first to last, as a list of
+        (row, count) runs of consecutive rows
+        """
+        if self.rows is None: return [(first, last - first + 1)]
 
-class ShowTitleCommand(Command):
-    """
-    Command which causes the title to be displayed
-    """
-    name = 'Show Titlescreen Logo'
-    description = 'Causes the titlescreen logo to become visible.'
+        runs = []
+        for row in self.rows[first:last + 1]:
+            if runs and runs[-1][0] + runs[-1][1] == row:
+                runs[-1] = (runs[-1][0], runs[-1][1] + 1)
+            else:
+                runs.append((row, 1))
+        return runs
 
-    def __init__(self):
-        super().__init__()
-        self.generateLayout()
+    def sourceInsertRow(self, row):
+        """
+        Return the source row to insert before to put something in the
+        given row
+        """
+        if self.rows is None: return row
+        if row < len(self.rows): return self.rows[row]
+        return self.rows[-1] + 1 if self.rows else self.sourceModel().rowCount()
 
+    def proxyRange(self, first, last):
+        """
+        Return the first and last rows that show any of the source rows
+        first to last. If none do, the first one is after the last one.
+        """
+        if self.rows is None: return first, last
+        return bisect.bisect_left(self.rows, first), bisect.bisect_right(self.rows, last) - 1
 
-class HideTitleCommand(Command):
-    """
-    Command which causes the title to be hidden
-    """
-    name = 'Hide Titlescreen Logo'
-    description = 'Hides the titlescreen logo.'
+    def mapToSource(self, index):
+        if not index.isValid(): return QtCore.QModelIndex()
+        return self.sourceModel().index(self.sourceRow(index.row()))
 
-    def __init__(self):
-        super().__init__()
-        self.generateLayout()
+    def mapFromSource(self, index):
+        if not index.isValid(): return QtCore.QModelIndex()
+        first, last = self.proxyRange(index.row(), index.row())
+        return self.index(first) if first == last else QtCore.QModelIndex()
 
+    def index(self, row, column=0, parent=QtCore.QModelIndex()):
+        if parent.isValid() or column != 0 or not 0 <= row < self.rowCount():
+            return QtCore.QModelIndex()
+        return self.createIndex(row, column)
 
-class PlayTitleAnimationCommand(Command):
-    """
-    Command which causes the title anim to be played
-    """
-    name = 'Play Titlescreen Logo Animation'
-    description = 'Plays a titlescreen logo animation.'
+    def parent(self, index=None):
+        if index is None: return super().parent() # QObject.parent()
+        return QtCore.QModelIndex()
 
-    def __init__(self):
-        super().__init__()
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid(): return 0
+        return self.sourceModel().rowCount() if self.rows is None else len(self.rows)
 
-        W = QtWidgets.QSpinBox()
-        W.setMaximum(0xFF)
-        self.widgets = []
-        self.widgets.append(('Animation ID:', W))
-        self.generateLayout()
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else 1
 
-    @classmethod
-    def fromData(cls, data):
-        cmd = cls()
-        cmd.widgets[0][1].setValue(data[0])
-        return cmd
+    def mimeTypes(self):
+        return self.sourceModel().mimeTypes()
 
-    def asData(self):
-        L = []
-        L.append(self.widgets[0][1].value())
-        return L
+    def mimeData(self, indexes):
+        # The source model doesn't look at the indexes
+        return self.sourceModel().mimeData([])
 
-    @property
-    def dynamicDescription(self):
-        return f'animation {self.widgets[0][1].value()}'
+    def supportedDropActions(self):
+        return self.sourceModel().supportedDropActions()
 
 
-class EnableEndingModeCommand(Command):
+class EditFieldUndo(QtWidgets.QUndoCommand):
     """
-    Command which causes the ending mode to be enabled
+    Undo step for changing one field of a command. Consecutive edits to
+    the same field (e.g. typing) merge into a single step. The command
+    is replaced with an edited copy rather than changed, since other
+    open files (and the parse cache) may share it.
     """
-    name = 'Enable Ending Mode'
-    description = ('Enables the ending mode. '
-        'The ending mode disables Wii remote input for player control.')
-
-    def __init__(self):
-        super().__init__()
-        self.generateLayout()
-
+    def __init__(self, viewer, row, attr, old, new):
+        super().__init__(f'Edit {viewer.model.commandAt(row).name}')
+        self.viewer = viewer
+        self.row, self.attr = row, attr
+        self.old, self.new = old, new
 
-class SpawnZoomCommand(Command):
-    """
-    Command which does something unknown
-    """
-    name = 'Spawn Zoom'
-    description = 'Spawns a hardcoded zoom actor in the stage.'
+    def id(self):
+        return 1
 
-    def __init__(self):
-        super().__init__()
-        self.generateLayout()
+    def mergeWith(self, other):
+        if (other.row, other.attr) != (self.row, self.attr): return False
+        self.new = other.new
+        return True
 
+    def setValue(self, value):
+        com = self.viewer.model.commandAt(self.row).copy()
+        setattr(com, self.attr, value)
+        self.viewer.model.replaceCommand(self.row, com)
+        self.viewer.showRow(self.row)
 
-class PlayPlayerWinAnimationsCommand(Command):
-    """
-    Command which causes the player win animations to be played
-    """
-    name = 'Play Player Win Animations'
-    description = 'Plays an animation for the player with the most coins.'
+    def redo(self):
+        self.setValue(self.new)
 
-    def __init__(self):
-        super().__init__()
-        self.generateLayout()
+    def undo(self):
+        self.setValue(self.old)
 
 
-class DestroyZoomCommand(Command):
+class InsertCommandsUndo(QtWidgets.QUndoCommand):
     """
-    Command which does something unknown
+    Undo step for inserting some commands. The commands are kept in
+    their encoded form while they're not in the file.
     """
-    name = 'Destroy Zoom'
-    description = 'Despawns a previously spawned zoom actor.'
-
-    def __init__(self):
-        super().__init__()
-        self.generateLayout()
-
+    def __init__(self, viewer, row, coms, text='Add Commands'):
+        super().__init__(text)
+        self.viewer = viewer
+        self.row, self.count = row, len(coms)
+        self.data = encodeForUndo(coms)
 
-class PlayersLookUpCommand(Command):
-    """
-    Command which causes the players to look up
-    """
-    name = 'Players Look Up'
-    description = 'Causes all players to look upward.'
+    def redo(self):
+        self.viewer.model.insertCommands(self.row, decodeForUndo(self.data))
+        self.viewer.selectRuns([(self.row, self.count)])
 
-    def __init__(self):
-        super().__init__()
-        self.generateLayout()
+    def undo(self):
+        self.viewer.model.removeCommands(self.row, self.count)
+        self.viewer.showRow(None)
 
 
-class TheEndCommand(Command):
+class RemoveCommandsUndo(QtWidgets.QUndoCommand):
     """
-    Command which causes 'The End' to be displayed
+    Undo step for removing some runs of commands, given as (row, count)
+    pairs in order. The commands are kept in their encoded form while
+    they're not in the file.
     """
-    name = 'Display "The End"'
-    description = 'Causes "The End" to appear on the screen.'
-
-    def __init__(self):
-        super().__init__()
-        self.generateLayout()
-
-
-class EndCreditsCommand(Command):
+    def __init__(self, viewer, runs, text='Remove Commands'):
+        super().__init__(text)
+        self.viewer = viewer
+        self.runs = runs
+        self.data = None
+
+    def redo(self):
+        model = self.viewer.model
+        coms = model.file.Commands
+        self.data = [encodeForUndo(coms[row:row + count]) for row, count in self.runs]
+
+        # Remove from the end, so the other rows stay where they are
+        for row, count in reversed(self.runs):
+            model.removeCommands(row, count)
+        self.viewer.showRow(None)
+
+    def undo(self):
+        for (row, count), data in zip(self.runs, self.data):
+            self.viewer.model.insertCommands(row, decodeForUndo(data))
+        self.data = None
+        self.viewer.selectRuns(self.runs)
+
+
+class MoveCommandsUndo(QtWidgets.QUndoCommand):
     """
-    Command which causes the credits to end
+    Undo step for moving some runs of commands. `moves` is a list of
+    (source, count, destination) moves to make in order, and `before`
+    and `after` are the runs to select before and after making them.
     """
-    name = 'End Credits'
-    description = 'End the credits.'
-
-    def __init__(self):
-        super().__init__()
-        self.generateLayout()
-
-
-class HideTheEndCommand(Command):
+    def __init__(self, viewer, moves, before, after, text='Move Commands'):
+        super().__init__(text)
+        self.viewer = viewer
+        self.moves = moves
+        self.before, self.after = before, after
+
+        # The moves that put everything back, in reverse order
+        self.inverse = []
+        for source, count, destination in reversed(moves):
+            newSource = destination if destination < source else destination - count
+            back = source if source < newSource else source + count
+            self.inverse.append((newSource, count, back))
+
+    def move(self, moves):
+        # The selection is replaced afterward anyway, and Qt would
+        # otherwise keep track of every selected row through the move
+        self.viewer.picker.clearSelection()
+
+        root = QtCore.QModelIndex()
+        for source, count, destination in moves:
+            self.viewer.model.moveRows(root, source, count, root, destination)
+
+    def redo(self):
+        self.move(self.moves)
+        self.viewer.selectRuns(self.after)
+
+    def undo(self):
+        self.move(self.inverse)
+        self.viewer.selectRuns(self.before)
+
+
+def planDrop(runs, row):
     """
-    Command which causes 'The End' to be hidden
+    Return the moves that gather the given runs of rows together in
+    front of `row`, keeping their order, and the run they end up as.
+    Each run is only moved once, however many rows are between them.
     """
-    name = 'Hide "The End"'
-    description = 'Causes "The End" to fade out.'
-
-    def __init__(self):
-        super().__init__()
-        self.generateLayout()
-
-
-class BeginFireworksCommand(Command):
+    # If a run spans the drop point, the others are gathered around it
+    top = bottom = row
+    for start, count in runs:
+        if start < row < start + count:
+            top, bottom = start, start + count
+
+    moves = []
+    # Runs above the drop point, from the closest one up...
+    for start, count in reversed(runs):
+        if start + count > top: continue
+        if start + count != top: moves.append((start, count, top))
+        top -= count
+    # ...and those below it, from the closest one down
+    for start, count in runs:
+        if start < bottom: continue
+        if start != bottom: moves.append((start, count, bottom))
+        bottom += count
+
+    return moves, (top, bottom - top)
+
+
+def planShift(runs, delta, rowCount):
     """
-    Command which causes fireworks to begin
+    Return the moves that shift the given runs of rows up (delta = -1)
+    or down (delta = 1) by one row, and the runs they end up as, or
+    None if that would go past either end of the file. Only the row
+    next to each run is moved, so this takes the same time however long
+    the runs are.
     """
-    name = 'Begin Fireworks'
-    description = 'Causes fireworks to begin in the background.'
-
-    def __init__(self):
-        super().__init__()
-        self.generateLayout()
+    if not runs: return None
+    if delta < 0:
+        if runs[0][0] == 0: return None
+        moves = [(start - 1, 1, start + count) for start, count in runs]
+    else:
+        if runs[-1][0] + runs[-1][1] >= rowCount: return None
+        moves = [(start + count, 1, start) for start, count in reversed(runs)]
+    return moves, [(start + delta, count) for start, count in runs]
 
 
-class EndFireworksCommand(Command):
+def encodeForUndo(coms):
     """
-    Command which causes fireworks to end
+    Return a compact form of a list of commands for the undo stack or
+    the clipboard: their records, with a null command at the end.
+    Commands that can't be encoded (because of unencodable text, for
+    instance) are kept as they are.
     """
-    name = 'End Fireworks'
-    description = 'Causes the background fireworks to end.'
-
-    def __init__(self):
-        super().__init__()
-        self.generateLayout()
-
-
+    try:
+        return b''.join(com.asBytes() for com in coms) + b'\x02\x00'
+    except ValueError:
+        return list(coms)
 
-CommandsById = {
-    0x01: DelayCommand,
-    0x02: SwitchSceneCommand,
-    0x03: SwitchSceneAndWaitCommand,
-    0x04: ShowScoresCommand,
-    0x05: ShowTextCommand,
-    0x06: HideTextCommand,
-    0x07: SetTextCommand,
-    0x08: ShowTitleCommand,
-    0x09: HideTitleCommand,
-    0x0A: PlayTitleAnimationCommand,
-    0x0B: EnableEndingModeCommand,
-    0x0C: SpawnZoomCommand,
-    0x0D: PlayPlayerWinAnimationsCommand,
-    0x0E: DestroyZoomCommand,
-    0x0F: PlayersLookUpCommand,
-    0x10: TheEndCommand,
-    0x11: EndCreditsCommand,
-    0x12: HideTheEndCommand,
-    0x13: BeginFireworksCommand,
-    0x14: EndFireworksCommand,
-    }
 
-
-def CommandFromData(data):
+def decodeForUndo(data):
     """
-    Return a command from data
+    Return the commands stored by encodeForUndo()
     """
-    return CommandsById[data[0]].fromData(data[1:])
+    if isinstance(data, bytes):
+        return NewerStaffRollBin(data).Commands
+    return list(data)
 
 
-class NewerStaffRollBin():
+class CreditsViewer(QtWidgets.QWidget):
     """
-    Class which represents NewerStaffRoll.bin
+    Widget that allows you to view credits data
     """
-    def __init__(self, data=None):
-        self.Commands = []
-        if data is not None: self._initFromData(data)
-
-    def _initFromData(self, data):
-        """
-        Initialise the NewerStaffRollBin from raw file data
-        """
 
-        # No headers. Iterate over the data until we've reached the EOF
-        # command
-        commands = []
-        i = 0
-        while True:
-            # Get the command data
-            datalen = data[i] - 1
-            i += 1
-            comdata = data[i:i+datalen]
-            i += datalen
-
-            if comdata[0] == 0: break
-
-            # Make a command
-            commands.append(CommandFromData(comdata))
-
-        # Assign to self.commands
-        self.Commands = commands
-
-
-    def save(self):
+    class DNDPicker(QtWidgets.QListView):
         """
-        Convert self.commands to bytes that can be saved
+        A list view that emits a signal when the selected commands are
+        dragged and dropped, instead of moving them itself
         """
-        data = []
-
-        coms = list(self.Commands)
+        # destination row
+        rowsDropped = QtCore.pyqtSignal(int)
 
-        for com in coms:
-            comdata = com.asData()
-            data.append(len(comdata) + 2)
+        def dataChanged(self, topLeft, bottomRight, roles=()):
+            # QListView lays out every row again when any data changes,
+            # which is slow for long scripts. Item sizes are uniform, so
+            # changed rows only need to be repainted.
+            if topLeft == bottomRight: self.update(topLeft)
+            else: self.viewport().update()
 
-            for id, comType in CommandsById.items():
-                if isinstance(com, comType):
-                    data.append(id)
-                    break
+        def dropEvent(self, event):
+            if event.source() is not self or not self.selectionModel().hasSelection():
+                event.ignore()
+                return
+
+            # Find the row to move to
+            index = self.indexAt(event.pos())
+            pos = self.dropIndicatorPosition()
+            if not index.isValid() or pos == self.OnViewport:
+                row = self.model().rowCount()
+            elif pos == self.BelowItem:
+                row = index.row() + 1
             else:
-                raise ValueError(f'Could not find ID of command: {com}')
-
-            for itm in comdata:
-                if not isinstance(itm, int):
-                    raise RuntimeError(f'{itm} is not an integer')
-                data.append(itm)
-
-        data.extend([2, 0]) # null command
-        return bytes(data)
-
-
-
-################################################################
-################################################################
-################################################################
-######################### UI Classes ###########################
-
-
-class CreditsViewer(QtWidgets.QWidget):
-    """
-    Widget that allows you to view credits data
-    """
+                row = index.row()
 
-    class DNDPicker(QtWidgets.QListWidget):
-        """
-        A list widget that emits a signal when an item has been moved
-        """
-        itemDropped = QtCore.pyqtSignal()
+            self.rowsDropped.emit(row)
 
-        def dropEvent(self, event):
-            super().dropEvent(event)
-            self.itemDropped.emit()
+            # The move is done through the signal, so don't let the view
+            # remove the source rows afterward
+            event.setDropAction(Qt.CopyAction)
+            event.accept()
 
     def __init__(self):
         super().__init__()
         self.file = None
 
+        # Edits are made through the undo stack. Each file can bring its
+        # own (see setFile()); this one is for files that don't.
+        self.defaultUndoStack = QtWidgets.QUndoStack(self)
+        self.defaultUndoStack.setUndoLimit(UndoLimit)
+        self.undoStack = self.defaultUndoStack
+
         # Create the command picker widgets
         PickerBox = QtWidgets.QGroupBox('Commands')
+        self.model = CommandListModel(self)
+        self.filterModel = CommandFilterModel(self.model, self)
         self.picker = self.DNDPicker(self)
+        self.picker.setModel(self.filterModel)
+        self.picker.setUniformItemSizes(True)
+        # Lay out rows a batch at a time, so big files don't freeze the
+        # event loop
+        self.picker.setLayoutMode(self.picker.Batched)
+        self.picker.setBatchSize(2000)
+        self.picker.setSelectionMode(self.picker.ExtendedSelection)
         self.picker.setDragDropMode(self.picker.InternalMove)
-        self.picker.itemDropped.connect(self.handleDragDrop)
+        self.picker.rowsDropped.connect(self.handleDragDrop)
         self.picker.setMinimumWidth(384)
         self.ABtn = QtWidgets.QPushButton('Add')
         self.RBtn = QtWidgets.QPushButton('Remove')
+        self.timeLabel = QtWidgets.QLabel()
+        self.lintLabel = QtWidgets.QLabel()
+        self.lintLabel.setAlignment(Qt.AlignRight | Qt.AlignVCenter)
+
+        # Problems are looked for in the background, shortly after
+        # each change
+        self.lintWorker = None
+        self.lintTimer = QtCore.QTimer(self)
+        self.lintTimer.setSingleShot(True)
+        self.lintTimer.timeout.connect(self.startLint)
+
+        # Create the search bar
+        self.searchEdit = QtWidgets.QLineEdit()
+        self.searchEdit.setPlaceholderText('Search text')
+        self.searchEdit.setClearButtonEnabled(True)
+        self.searchEdit.textChanged.connect(self.handleSearch)
+        self.searchEdit.returnPressed.connect(lambda: self.handleFindNext(1))
+        self.prevBtn = QtWidgets.QToolButton()
+        self.prevBtn.setArrowType(Qt.UpArrow)
+        self.prevBtn.setToolTip('<b>Previous:</b><br>Selects the previous command that matches the search')
+        self.prevBtn.clicked.connect(lambda: self.handleFindNext(-1))
+        self.nextBtn = QtWidgets.QToolButton()
+        self.nextBtn.setArrowType(Qt.DownArrow)
+        self.nextBtn.setToolTip('<b>Next:</b><br>Selects the next command that matches the search')
+        self.nextBtn.clicked.connect(lambda: self.handleFindNext(1))
+        self.hitsLabel = QtWidgets.QLabel()
 
         # Add some tooltips
-        self.ABtn.setToolTip('<b>Add:</b><br>Adds a command after the currently selected command')
-        self.RBtn.setToolTip('<b>Remove:</b><br>Removes the currently selected command')
+        self.ABtn.setToolTip('<b>Add:</b><br>Adds commands after the currently selected commands, by typing their names')
+        self.RBtn.setToolTip('<b>Remove:</b><br>Removes the selected commands')
+
+        # Create actions for the Edit menu
+        self.cutAct = QtWidgets.QAction('Cut', self)
+        self.cutAct.setShortcut(QtGui.QKeySequence.Cut)
+        self.cutAct.triggered.connect(self.handleCut)
+        self.copyAct = QtWidgets.QAction('Copy', self)
+        self.copyAct.setShortcut(QtGui.QKeySequence.Copy)
+        self.copyAct.triggered.connect(self.handleCopy)
+        self.pasteAct = QtWidgets.QAction('Paste', self)
+        self.pasteAct.setShortcut(QtGui.QKeySequence.Paste)
+        self.pasteAct.triggered.connect(self.handlePaste)
+        self.addAct = QtWidgets.QAction('Add Commands...', self)
+        self.addAct.setShortcut('Ctrl+I')
+        self.addAct.triggered.connect(self.handleAdd)
+        self.deleteAct = QtWidgets.QAction('Delete', self)
+        self.deleteAct.setShortcut(QtGui.QKeySequence.Delete)
+        self.deleteAct.triggered.connect(self.handleRemove)
+        self.moveUpAct = QtWidgets.QAction('Move Up', self)
+        self.moveUpAct.setShortcut('Alt+Up')
+        self.moveUpAct.triggered.connect(lambda: self.handleShift(-1))
+        self.moveDownAct = QtWidgets.QAction('Move Down', self)
+        self.moveDownAct.setShortcut('Alt+Down')
+        self.moveDownAct.triggered.connect(lambda: self.handleShift(1))
+        self.selectionActs = (self.cutAct, self.copyAct, self.deleteAct, self.moveUpAct, self.moveDownAct)
+        self.findAct = QtWidgets.QAction('Find...', self)
+        self.findAct.setShortcut(QtGui.QKeySequence.Find)
+        self.findAct.triggered.connect(self.handleFind)
+        self.findNextAct = QtWidgets.QAction('Find Next', self)
+        self.findNextAct.setShortcut(QtGui.QKeySequence.FindNext)
+        self.findNextAct.triggered.connect(lambda: self.handleFindNext(1))
+        self.findPrevAct = QtWidgets.QAction('Find Previous', self)
+        self.findPrevAct.setShortcut(QtGui.QKeySequence.FindPrevious)
+        self.findPrevAct.triggered.connect(lambda: self.handleFindNext(-1))
+        self.nextProblemAct = QtWidgets.QAction('Next Problem', self)
+        self.nextProblemAct.setShortcut('F8')
+        self.nextProblemAct.triggered.connect(self.handleNextProblem)
 
         # Connect them to handlers
-        self.picker.currentItemChanged.connect(self.handleComSel)
+        self.picker.selectionModel().currentChanged.connect(self.handleComSel)
+        self.picker.selectionModel().selectionChanged.connect(self.handleSelectionChanged)
         self.ABtn.clicked.connect(self.handleAdd)
         self.RBtn.clicked.connect(self.handleRemove)
+        self.filterModel.modelReset.connect(self.updateSearchWidgets)
+        for signal in (self.model.modelReset, self.model.rowsInserted,
+                self.model.rowsRemoved, self.model.rowsMoved, self.model.dataChanged):
+            signal.connect(self.updateTotalTime)
+            signal.connect(self.scheduleLint)
 
         # Disable them for now
         self.picker.setEnabled(False)
+        self.searchEdit.setEnabled(False)
         self.ABtn.setEnabled(False)
+        self.addAct.setEnabled(False)
         self.RBtn.setEnabled(False)
+        self.pasteAct.setEnabled(False)
+        for act in self.selectionActs: act.setEnabled(False)
 
         # Set up the QGroupBox layout
+        searchL = QtWidgets.QHBoxLayout()
+        searchL.addWidget(self.searchEdit)
+        searchL.addWidget(self.hitsLabel)
+        searchL.addWidget(self.prevBtn)
+        searchL.addWidget(self.nextBtn)
         L = QtWidgets.QGridLayout()
-        L.addWidget(self.picker, 0, 0, 1, 2)
-        L.addWidget(self.ABtn, 1, 0)
-        L.addWidget(self.RBtn, 1, 1)
+        L.addLayout(searchL, 0, 0, 1, 2)
+        L.addWidget(self.picker, 1, 0, 1, 2)
+        L.addWidget(self.timeLabel, 2, 0)
+        L.addWidget(self.lintLabel, 2, 1)
+        L.addWidget(self.ABtn, 3, 0)
+        L.addWidget(self.RBtn, 3, 1)
         PickerBox.setLayout(L)
+        self.updateSearchWidgets()
 
-        # Create the command editor
+        # Create the command editor. There's one editor for each set of
+        # fields, which is reused for every command that has them.
         self.ComBox = QtWidgets.QGroupBox('Command')
-        self.edit = CommandEditor()
-        self.edit.dataChanged.connect(self.handleComDatChange)
+        self.editStack = QtWidgets.QStackedWidget()
+        self.editors = {}
+        self.edit = None
+        self.setComEdit(None)
+
+        # The Add dialog is made the first time it's needed
+        self.commandPalette = None
         L = QtWidgets.QVBoxLayout()
-        L.addWidget(self.edit)
+        L.addWidget(self.editStack)
         self.ComBox.setLayout(L)
 
         # Make the main layout
@@ -597,47 +736,52 @@ class CreditsViewer(QtWidgets.QWidget):
         L.addWidget(self.ComBox)
         self.setLayout(L)
 
-    # Ideally, we could just set the corresponding Command to each
-    # QListWidgetItem's UserRole data. And that worked in old versions
-    # of PyQt. Now, however, PyQt pickles the data upon starting a drag,
-    # and Commands can't be pickled because they have widgets in their
-    # attributes. Therefore, we have to maintain our own
-    # item <-> command map that works even if an item is pickled and
-    # unpickled. To do this, we set its UserRole data to a random UUID
-    # that matches an attribute of its corresponding command. Then we
-    # use that as the basis for associations between the two.
-
-    _itemCommandMap = None
-    def commandForItem(self, item):
-        if self._itemCommandMap is None:
-            self._itemCommandMap = {}
-        return self._itemCommandMap.get(item.data(Qt.UserRole))
-    def setCommandForItem(self, item, command):
-        if self._itemCommandMap is None:
-            self._itemCommandMap = {}
-        item.setData(Qt.UserRole, command.uuid)
-        self._itemCommandMap[command.uuid] = command
-
-    def setFile(self, file):
+    def setFile(self, file, undoStack=None, viewState=None):
         """
-        Change the file to view
+        Change the file to view (or clear the viewer, if file is None).
+        Edits go on undoStack, or on the viewer's own undo stack (which
+        is cleared) if that's None. viewState, from viewState(), puts
+        back the search, selection and scroll position the file had.
         """
-        self.file = file
-        self.picker.clear()
-        self.setComEdit(CommandEditor()) # clears it
+        if undoStack is None:
+            undoStack = self.defaultUndoStack
+            undoStack.clear()
+        self.undoStack = undoStack
 
-        # Enable widgets
-        self.picker.setEnabled(True)
-        self.ABtn.setEnabled(True)
-        self.RBtn.setEnabled(False)
+        # Don't search the new file for the old file's search
+        self.searchEdit.clear()
 
-        # Add commands
-        for com in file.Commands:
-            item = QtWidgets.QListWidgetItem() # self.updateNames will add the name
-            self.setCommandForItem(item, com)
-            self.picker.addItem(item)
+        self.file = file
+        self.model.setFile(file)
+        self.setComEdit(None)
 
-        self.updateNames()
+        # Enable widgets
+        self.picker.setEnabled(file is not None)
+        self.searchEdit.setEnabled(file is not None)
+        self.ABtn.setEnabled(file is not None)
+        self.addAct.setEnabled(file is not None)
+        self.pasteAct.setEnabled(file is not None)
+        self.handleSelectionChanged()
+        self.updateLintLabel()
+
+        if viewState is not None:
+            query, runs, topRow = viewState
+            self.searchEdit.setText(query)
+            self.selectRuns(runs)
+            if topRow is not None:
+                first, last = self.filterModel.proxyRange(topRow, topRow)
+                if first <= last:
+                    self.picker.scrollTo(self.filterModel.index(first), self.picker.PositionAtTop)
+
+    def viewState(self):
+        """
+        Return what setFile() needs to show the current file the same
+        way again after showing a different one: the search, the
+        selected rows and the row at the top of the list
+        """
+        top = self.picker.indexAt(QtCore.QPoint(0, 0))
+        topRow = self.filterModel.sourceRow(top.row()) if top.isValid() else None
+        return self.searchEdit.text(), self.selectedRuns(), topRow
 
     def saveFile(self):
         """
@@ -649,152 +793,410 @@ class CreditsViewer(QtWidgets.QWidget):
         """
         Update item names in the command picker
         """
+        self.model.updateNames()
+
+    def updateTotalTime(self):
+        """
+        Update the label showing how long the credits take
+        """
+        frames = self.model.timeline.totalFrames()
+        if self.model.timeline.isMinimum():
+            self.timeLabel.setText(f'Total time: at least {formatFrames(frames)} ({frames}+ frames)')
+            self.timeLabel.setToolTip(self.model.MinimumTimeNote)
+        else:
+            self.timeLabel.setText(f'Total time: {formatFrames(frames)} ({frames} frames)')
+            self.timeLabel.setToolTip('')
+
+    def showRow(self, row):
+        """
+        Select and scroll to a row (or clear the selection, if row is
+        None), and make sure the editor shows its current values
+        """
+        if row is None:
+            self.picker.setCurrentIndex(QtCore.QModelIndex())
+        else:
+            self.selectRuns([(row, 1)])
 
-        # This is apparently the best way to iterate over all items in
-        # the list widget.
-        for item in self.picker.findItems('', Qt.MatchContains):
-            com = self.commandForItem(item)
+    def insertionRow(self):
+        """
+        Return the row that added or pasted commands go in: after the
+        selected ones, or at the end if nothing's selected
+        """
+        runs = self.selectedRuns()
+        return runs[-1][0] + runs[-1][1] if runs else self.model.rowCount()
 
-            # Pick text and tooltips
-            text = com.name
-            tooltip = f'<b>{com.name}:</b><br>{com.description}'
+    def selectedRuns(self):
+        """
+        Return the selected rows as a sorted list of (row, count) runs of
+        consecutive rows
+        """
+        ranges = sorted((row, row + count)
+            for r in self.picker.selectionModel().selection()
+            for row, count in self.filterModel.sourceRuns(r.top(), r.bottom()))
+        runs = []
+        for top, bottom in ranges:
+            if runs and top <= runs[-1][0] + runs[-1][1]:
+                start = runs[-1][0]
+                runs[-1] = (start, max(bottom, start + runs[-1][1]) - start)
+            else:
+                runs.append((top, bottom - top))
+        return runs
 
-            if com.dynamicDescription:
-                text += f' ({com.dynamicDescription})'
+    def selectRuns(self, runs):
+        """
+        Select some (row, count) runs of rows, and scroll to and edit the
+        first one. Rows hidden by the search are left out.
+        """
+        selection = QtCore.QItemSelection()
+        for row, count in runs:
+            first, last = self.filterModel.proxyRange(row, row + count - 1)
+            if first <= last:
+                selection.select(self.filterModel.index(first), self.filterModel.index(last))
+        if selection.isEmpty():
+            self.showRow(None)
+            return
+
+        selModel = self.picker.selectionModel()
+        index = self.filterModel.index(selection[0].top())
+        if selModel.currentIndex() != index:
+            selModel.setCurrentIndex(index, selModel.NoUpdate)
+        elif self.edit.com is not self.model.commandAt(self.filterModel.sourceRow(index.row())):
+            # A different command was moved into the current row
+            self.handleComSel()
+        else:
+            self.edit.refresh()
+        selModel.select(selection, selModel.ClearAndSelect)
+        self.picker.scrollTo(index)
+
+    def handleFieldEdit(self, attr, value):
+        """
+        Handle the user editing a field of the current command
+        """
+        row = self.filterModel.sourceRow(self.picker.currentIndex().row())
+        old = getattr(self.model.commandAt(row), attr)
+        self.undoStack.push(EditFieldUndo(self, row, attr, old, value))
 
-            # Set text
-            item.setText(text)
-            item.setToolTip(tooltip)
+    def handleDragDrop(self, destination):
+        """
+        Handle dragging and dropping the selected commands
+        """
+        runs = self.selectedRuns()
+        moves, after = planDrop(runs, self.filterModel.sourceInsertRow(destination))
+        if moves:
+            self.undoStack.push(MoveCommandsUndo(self, moves, runs, [after]))
 
-    def handleDragDrop(self):
+    def handleShift(self, delta):
+        """
+        Handle the user moving the selected commands up (delta = -1) or
+        down (delta = 1)
         """
-        Handle dragging and dropping
+        runs = self.selectedRuns()
+        plan = planShift(runs, delta, self.model.rowCount())
+        if plan is None: return
+        moves, after = plan
+        text = 'Move Commands Up' if delta < 0 else 'Move Commands Down'
+        self.undoStack.push(MoveCommandsUndo(self, moves, runs, after, text))
+
+    def handleSearch(self, query):
         """
-        # First, update the file
-        newCommands = []
-        for item in self.picker.findItems('', Qt.MatchContains):
-            com = self.commandForItem(item)
-            newCommands.append(com)
-        self.file.Commands = newCommands
+        Handle the user changing the search
+        """
+        # Keep whichever selected commands are still shown
+        runs = self.selectedRuns()
+        self.filterModel.setQuery(query)
+        if runs: self.selectRuns(runs)
 
-        # Then, update the names
-        self.updateNames()
+    def handleFind(self):
+        """
+        Move the keyboard focus to the search bar
+        """
+        self.searchEdit.setFocus()
+        self.searchEdit.selectAll()
 
-    def handleComDatChange(self):
+    def handleFindNext(self, delta):
         """
-        Handle changes to the current message data
+        Select the next (delta = 1) or previous (delta = -1) command that
+        matches the search
         """
-        self.updateNames()
+        count = self.filterModel.rowCount()
+        if self.filterModel.rows is None or not count: return
 
-    def handleComSel(self):
-        self.setComEdit(CommandEditor()) # clears it
+        current = self.picker.currentIndex()
+        if current.isValid():
+            row = (current.row() + delta) % count
+        else:
+            row = 0 if delta > 0 else count - 1
+        self.showRow(self.filterModel.sourceRow(row))
+
+    def updateSearchWidgets(self):
+        """
+        Update the number of matches and the next/previous buttons
+        """
+        searching = self.filterModel.rows is not None
+        if searching:
+            count = len(self.filterModel.rows)
+            self.hitsLabel.setText('1 match' if count == 1 else f'{count} matches')
+        self.hitsLabel.setVisible(searching)
+        for w in (self.prevBtn, self.nextBtn, self.findNextAct, self.findPrevAct):
+            w.setEnabled(searching)
+
+    def scheduleLint(self, *args):
+        """
+        Check for problems once the current batch of changes is done
+        """
+        self.lintTimer.start()
+
+    def startLint(self):
+        """
+        Start checking the part of the file that's changed for problems,
+        unless that's already being done
+        """
+        if self.lintWorker is not None: return
+        job = self.model.lint.nextJob()
+        if job is None: return
 
-        # Get the current item (it's None if nothing's selected)
-        currentItem = self.picker.currentItem()
+        self.lintWorker = LintWorker(job)
+        self.lintWorker.signals.finished.connect(self.handleLintFinished)
+        QtCore.QThreadPool.globalInstance().start(self.lintWorker)
 
-        # Update the Remove btn
-        self.RBtn.setEnabled(currentItem is not None)
+    def handleLintFinished(self, job, result):
+        """
+        Show the problems found by a lint job, and start another one if
+        anything's changed since
+        """
+        self.lintWorker = None
+        self.model.applyLint(job, result)
+        self.updateLintLabel()
+        self.startLint()
 
-        # Get the command
-        if currentItem is None: return
-        com = self.commandForItem(currentItem)
+    def updateLintLabel(self):
+        """
+        Update the label showing how many problems there are
+        """
+        count = self.model.lint.count()
+        if self.file is None:
+            self.lintLabel.setText('')
+        elif not count:
+            self.lintLabel.setText('No problems')
+        else:
+            self.lintLabel.setText('1 problem' if count == 1 else f'{count} problems')
+        self.lintLabel.setToolTip('<br>'.join(html.escape(m) for m in self.model.lint.fileIssues))
+
+    def handleNextProblem(self):
+        """
+        Select the next command with a problem
+        """
+        rows = sorted(self.model.lint.issues)
+        if not rows: return
+        current = self.picker.currentIndex()
+        row = self.filterModel.sourceRow(current.row()) if current.isValid() else -1
+        i = bisect.bisect_right(rows, row)
+        self.showRow(rows[i % len(rows)])
+
+    def handleSelectionChanged(self):
+        """
+        Enable or disable the things that act on the selected commands
+        """
+        selected = self.picker.selectionModel().hasSelection()
+        self.RBtn.setEnabled(selected)
+        for act in self.selectionActs: act.setEnabled(selected)
 
-        # Set up the command editor
-        e = CommandEditor(com)
-        self.setComEdit(e)
+    def handleComSel(self):
+        """
+        Show the current command in the editor
+        """
+        # Get the current index (it's invalid if nothing's selected)
+        current = self.picker.currentIndex()
+        if current.isValid():
+            self.setComEdit(self.model.commandAt(self.filterModel.sourceRow(current.row())))
+        else:
+            self.setComEdit(None)
 
     def handleAdd(self):
         """
         Handle the user clicking Add
         """
-        comT = getUserPickedCommand()
-        if comT is None: return
-        com = comT()
-
-        # Add it to self.file and self.picker
-        self.file.Commands.append(com)
-        item = QtWidgets.QListWidgetItem()
-        self.setCommandForItem(item, com)
-        self.picker.addItem(item)
-        self.picker.scrollToItem(item)
-        item.setSelected(True)
+        if self.commandPalette is None: self.commandPalette = CommandPalette(self)
+        types = self.commandPalette.pick()
+        if not types: return
 
-        self.updateNames()
+        text = f'Add {types[0].name}' if len(types) == 1 else f'Add {len(types)} Commands'
+        self.undoStack.push(InsertCommandsUndo(self, self.insertionRow(), [comT() for comT in types], text))
 
     def handleRemove(self):
         """
         Handle the user clicking Remove
         """
-        item = self.picker.currentItem()
-        com = self.commandForItem(item)
-
-        # Remove it from file and the picker
-        self.file.Commands.remove(com)
-        self.picker.takeItem(self.picker.row(item))
+        runs = self.selectedRuns()
+        if not runs: return
+        if runs == [(runs[0][0], 1)]:
+            text = f'Remove {self.model.commandAt(runs[0][0]).name}'
+        else:
+            text = 'Remove Commands'
+        self.undoStack.push(RemoveCommandsUndo(self, runs, text))
+
+    def handleCopy(self):
+        """
+        Copy the selected commands to the clipboard. Returns False if
+        they can't be copied.
+        """
+        coms = self.file.Commands
+        data = encodeForUndo([com for row, count in self.selectedRuns() for com in coms[row:row + count]])
+        if not isinstance(data, bytes):
+            QtWidgets.QMessageBox.warning(self, 'Copy',
+                'Some of the selected commands contain text that can\'t be saved, so they can\'t be copied.')
+            return False
+
+        mime = QtCore.QMimeData()
+        mime.setData(CommandsMimeType, data)
+        QtWidgets.QApplication.clipboard().setMimeData(mime)
+        return True
+
+    def handleCut(self):
+        """
+        Cut the selected commands to the clipboard
+        """
+        if self.handleCopy():
+            self.undoStack.push(RemoveCommandsUndo(self, self.selectedRuns(), 'Cut Commands'))
 
-        # Clear the selection
-        self.setComEdit(CommandEditor())
-        self.picker.clearSelection()
-        self.RBtn.setEnabled(False)
+    def handlePaste(self):
+        """
+        Paste commands from the clipboard after the selected ones (or at
+        the end, if nothing's selected)
+        """
+        mime = QtWidgets.QApplication.clipboard().mimeData()
+        if mime is None or not mime.hasFormat(CommandsMimeType): return
+        try:
+            coms = NewerStaffRollBin(bytes(mime.data(CommandsMimeType))).Commands
+        except (ValueError, IndexError):
+            return
+        if not coms: return
 
-        self.updateNames()
+        self.undoStack.push(InsertCommandsUndo(self, self.insertionRow(), coms, 'Paste Commands'))
 
-    def setComEdit(self, e):
+    def setComEdit(self, com):
         """
-        Change the current CommandEditor
+        Show the editor for a command (or an empty one, if com is None)
         """
-        x = self.ComBox.layout().takeAt(0)
-        if x is not None: x.widget().delete()
+        fields = () if com is None else com.fields
+        e = self.editors.get(fields)
+        if e is None:
+            e = self.editors[fields] = CommandEditor(fields)
+            e.fieldEdited.connect(self.handleFieldEdit)
+            self.editStack.addWidget(e)
 
-        self.ComBox.layout().addWidget(e)
-        e.dataChanged.connect(self.handleComDatChange)
-        self.ComBox.update()
+        # Don't let the previous editor keep its command alive
+        if self.edit is not None and self.edit is not e:
+            self.edit.setCommand(None)
+
+        e.setCommand(com)
+        self.editStack.setCurrentWidget(e)
+        self.edit = e
 
 
 
-# NOTE: Due to Qt's limitations, this works differently
-# than it did in my other tools. A new instance of this
-# is created every time the selection changes.
 class CommandEditor(QtWidgets.QWidget):
     """
-    Widget that allows you to edit a command
+    Widget that allows you to edit commands with a particular set of
+    fields. Rather than making a new one every time the selection
+    changes, the same editor is pointed at each command in turn with
+    setCommand().
     """
-    dataChanged = QtCore.pyqtSignal()
+    # attribute, new value
+    fieldEdited = QtCore.pyqtSignal(str, object)
 
-    def __init__(self, com=None):
+    def __init__(self, fields=()):
         super().__init__()
-        self.com = Command() if com is None else com
-
-        # Set the layout
-        self.setLayout(self.com.layout)
-        self.setMinimumWidth(384)
+        self.com = None
 
-        # Connect each widget to the handler
-        for i in range(self.com.layout.count()):
-            w = self.com.layout.itemAt(i).widget()
+        # Make a widget for each field
+        self.widgets = []
+        for attr, label, kind in fields:
+            W = self.createWidget(kind)
+            self.widgets.append((attr, label, W))
 
-            connectors = {
+            # Connect the widget to the handler
+            signal = getattr(W, {
                 QtWidgets.QSpinBox: 'valueChanged',
                 QtWidgets.QLineEdit: 'textEdited',
                 QtWidgets.QPlainTextEdit: 'textChanged',
-                }
-            for type, name in connectors.items():
-                if isinstance(w, type):
-                    getattr(w, name).connect(self.handleDataChanged)
+                }[type(W)])
+            signal.connect(lambda *args, attr=attr, W=W: self.handleDataChanged(attr, W))
+
+        # Set the layout
+        if self.widgets:
+            L = QtWidgets.QFormLayout()
+            for attr, label, W in self.widgets:
+                L.addRow(label, W)
+        else: L = getNullLayout()
+        self.setLayout(L)
+        self.setMinimumWidth(384)
+
+
+    @staticmethod
+    def createWidget(kind):
+        """
+        Return a new widget that can edit a field of the given kind
+        """
+        if not kind.isString:
+            W = QtWidgets.QSpinBox()
+            W.setMaximum(min(kind.maximum, 0x7FFFFFFF)) # the most a QSpinBox can hold
+        elif not kind.multiline:
+            W = QtWidgets.QLineEdit()
+        else:
+            W = QtWidgets.QPlainTextEdit()
+            W.setLineWrapMode(W.NoWrap)
+        return W
+
+
+    @staticmethod
+    def setWidgetValue(W, value):
+        """
+        Put a field value into a widget made by createWidget()
+        """
+        if isinstance(W, QtWidgets.QSpinBox): W.setValue(value)
+        elif isinstance(W, QtWidgets.QLineEdit): W.setText(value)
+        else: W.setPlainText(value)
+
+
+    @staticmethod
+    def widgetValue(W):
+        """
+        Return the field value from a widget made by createWidget()
+        """
+        if isinstance(W, QtWidgets.QSpinBox): return W.value()
+        elif isinstance(W, QtWidgets.QLineEdit): return str(W.text())
+        else: return str(W.toPlainText())
+
+
+    def setCommand(self, com):
+        """
+        Change the command being edited (or edit nothing, if com is
+        None)
+        """
+        self.com = com
+        self.refresh()
 
 
-    def delete(self):
+    def refresh(self):
         """
-        Prepare to be deleted
+        Update the widgets to match the command's current values
         """
-        self.hide()
+        if self.com is None: return
+        for attr, label, W in self.widgets:
+            value = getattr(self.com, attr)
+            if self.widgetValue(W) == value: continue
+            W.blockSignals(True)
+            self.setWidgetValue(W, value)
+            W.blockSignals(False)
 
 
-    def handleDataChanged(self):
+    def handleDataChanged(self, attr, W):
         """
-        Handle data changes
+        Handle data changes. The command itself is changed by whoever
+        receives fieldEdited, so that the change can be undone.
         """
-        self.dataChanged.emit()
+        self.fieldEdited.emit(attr, self.widgetValue(W))
 
 
 def getNullLayout():
@@ -809,43 +1211,220 @@ def getNullLayout():
     return L
 
 
-def getUserPickedCommand():
+class CommandPalette(QtWidgets.QDialog):
     """
-    Return a command picked by the user
+    Dialog for adding commands by typing their names. Several can be
+    added at once by separating them with commas, and the whole
+    sequence can be repeated by ending it with "* count".
     """
-    dlg = CommandPickDlg()
-    if dlg.exec_() != dlg.Accepted: return
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle('Add Commands')
+        self.setMinimumWidth(384)
+        self.index = CommandTypeIndex()
+
+        self.edit = QtWidgets.QLineEdit()
+        self.edit.setPlaceholderText('Command name, or several separated by commas')
+        self.edit.textChanged.connect(self.updateMatches)
+        self.edit.installEventFilter(self)
+
+        # The commands matching the part being typed
+        self.matches = QtWidgets.QListWidget()
+        self.matches.setFocusPolicy(Qt.NoFocus)
+        self.matches.currentRowChanged.connect(self.updatePreview)
+        self.matches.itemActivated.connect(self.accept)
+
+        self.preview = QtWidgets.QLabel()
+        self.preview.setWordWrap(True)
+        hint = QtWidgets.QLabel('<i>For example, "set text, show, wait, hide * 10". '
+            'Up and Down pick a command, Tab fills it in.</i>')
+        hint.setWordWrap(True)
+        hint.setEnabled(False)
+
+        self.buttonBox = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel)
+        self.buttonBox.accepted.connect(self.accept)
+        self.buttonBox.rejected.connect(self.reject)
+
+        L = QtWidgets.QVBoxLayout()
+        L.addWidget(self.edit)
+        L.addWidget(self.matches)
+        L.addWidget(self.preview)
+        L.addWidget(hint)
+        L.addWidget(self.buttonBox)
+        self.setLayout(L)
+
+        self.updateMatches()
+
+    def eventFilter(self, obj, event):
+        """
+        Let the arrow keys move through the matches, and Tab fill in the
+        current one, while typing
+        """
+        if obj is self.edit and event.type() == QtCore.QEvent.KeyPress:
+            if event.key() in (Qt.Key_Up, Qt.Key_Down, Qt.Key_PageUp, Qt.Key_PageDown):
+                QtWidgets.QApplication.sendEvent(self.matches, event)
+                return True
+            if event.key() == Qt.Key_Tab and event.modifiers() == Qt.NoModifier:
+                self.completeCurrent()
+                return True
+        return super().eventFilter(obj, event)
+
+    def pick(self):
+        """
+        Show the dialog, and return the command types to add, in order,
+        or an empty list if the user cancelled. The last query is kept,
+        so the same commands can be added again by just pressing Enter.
+        """
+        self.edit.selectAll()
+        self.edit.setFocus()
+        if self.exec_() != self.Accepted: return []
+        types, count = self.sequence()
+        return (types or []) * count
+
+    def sequence(self):
+        """
+        Return the command types the query asks for, and how many times
+        to add them. The types are None if any part doesn't match.
+        """
+        parts, count = self.index.splitSequence(self.edit.text())
+        types = []
+        for i, part in enumerate(parts):
+            if not part: continue
+            if i == len(parts) - 1:
+                # The part being typed uses whichever match is current
+                item = self.matches.currentItem()
+                cls = None if item is None else item.data(Qt.UserRole)
+            else:
+                found = self.index.find(part)
+                cls = found[0] if found else None
+            if cls is None: return None, count
+            types.append(cls)
+        return types, count
 
-    return dlg.combo.itemData(dlg.combo.currentIndex())
+    def updateMatches(self):
+        """
+        List the commands matching the part being typed
+        """
+        parts, count = self.index.splitSequence(self.edit.text())
+        self.matches.clear()
+        for cls in self.index.find(parts[-1]):
+            item = QtWidgets.QListWidgetItem(cls.name)
+            item.setData(Qt.UserRole, cls)
+            item.setToolTip(cls.description)
+            self.matches.addItem(item)
+        self.matches.setCurrentRow(0)
+        self.updatePreview()
+
+    def updatePreview(self):
+        """
+        Show the commands that will be added
+        """
+        types, count = self.sequence()
+        if types is None:
+            self.preview.setText('<font color="red">Some of those don\'t match any commands</font>')
+        elif not types:
+            self.preview.setText('')
+        else:
+            names = ' \u2192 '.join(html.escape(cls.name) for cls in types)
+            self.preview.setText(f'<b>{names}</b>' + (f' \u00d7 {count}' if count > 1 else ''))
+        self.buttonBox.button(QtWidgets.QDialogButtonBox.Ok).setEnabled(bool(types))
+
+    def completeCurrent(self):
+        """
+        Replace the part being typed with the current match's name, ready
+        to type the next one
+        """
+        item = self.matches.currentItem()
+        if item is None: return
+        text = self.edit.text()
+        separators = list(self.index.SequenceSeparator.finditer(text))
+        start = separators[-1].end() if separators else 0
+        self.edit.setText(f'{text[:start].rstrip()}{" " if start else ""}{item.text()}, ')
 
 
-class CommandPickDlg(QtWidgets.QDialog):
+class FileLoader(QtCore.QRunnable):
     """
-    Dialog that lets the user pick a command type
+    Parses a file on a worker thread, handing the commands back in
+    chunks as it goes. If a ParseCache is given and already has the
+    file's contents, they're all handed back at once instead.
     """
-    def __init__(self):
+    class Signals(QtCore.QObject):
+        commandsLoaded = QtCore.pyqtSignal(object) # list of commands
+        progress = QtCore.pyqtSignal(int, int) # bytes parsed, total bytes
+        finished = QtCore.pyqtSignal()
+        failed = QtCore.pyqtSignal(str)
+
+    # The first chunk is small so that something shows up right away.
+    # Each one after that is twice as big, up to the maximum.
+    FirstChunkSize = 256
+    MaxChunkSize = 32768
+
+    def __init__(self, path, cache=None):
         super().__init__()
+        self.setAutoDelete(False)
+        self.path = path
+        self.cache = cache
+        self.signals = self.Signals()
+        self.cancelled = False
+
+    def cancel(self):
+        """
+        Stop loading as soon as possible. No more signals are emitted.
+        """
+        self.cancelled = True
 
-        label = QtWidgets.QLabel('Choose a command type to insert:')
+    def run(self):
+        try:
+            data = mapFile(self.path)
+            if self.cache is not None:
+                key = self.cache.key(data)
+                cached = self.cache.get(key)
+                if cached is not None:
+                    if self.cancelled: return
+                    self.signals.commandsLoaded.emit(list(cached))
+                    self.signals.finished.emit()
+                    return
+
+            coms = []
+            start = 0
+            chunkSize = self.FirstChunkSize
+            for opcode, offset, payload in iterCommands(data):
+                coms.append(CommandsById[opcode].fromData(payload))
+                if len(coms) - start < chunkSize: continue
+
+                if self.cancelled: return
+                self.signals.commandsLoaded.emit(coms[start:])
+                self.signals.progress.emit(offset, len(data))
+                start = len(coms)
+                chunkSize = min(chunkSize * 2, self.MaxChunkSize)
+
+            if self.cancelled: return
+            if start < len(coms): self.signals.commandsLoaded.emit(coms[start:])
+            if self.cache is not None: self.cache.put(key, coms, len(data))
+            self.signals.finished.emit()
+
+        except (OSError, ValueError, IndexError) as e:
+            if not self.cancelled: self.signals.failed.emit(str(e))
+
+
+
+class LintWorker(QtCore.QRunnable):
+    """
+    Runs a lint job (see staffroll.LintResults) on a worker thread
+    """
+    class Signals(QtCore.QObject):
+        finished = QtCore.pyqtSignal(object, object) # job, result
 
-        # Make a combobox and add entries
-        entries = sorted(CommandsById.values(), key=lambda com: com.name)
-        self.combo = QtWidgets.QComboBox()
-        items = []
-        for com in entries:
-            self.combo.addItem(com.name, com)
+    def __init__(self, job):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.job = job
+        self.signals = self.Signals()
 
-        # Make a buttonbox
-        buttonBox = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel)
-        buttonBox.accepted.connect(self.accept)
-        buttonBox.rejected.connect(self.reject)
+    def run(self):
+        job = self.job
+        self.signals.finished.emit(job, lintCommands(job.commands, job.states, job.dirty))
 
-        # Add a layout
-        L = QtWidgets.QVBoxLayout()
-        L.addWidget(label)
-        L.addWidget(self.combo)
-        L.addWidget(buttonBox)
-        self.setLayout(L)
 
 
 ################################################################
@@ -854,20 +1433,98 @@ class CommandPickDlg(QtWidgets.QDialog):
 ######################### Main Window ##########################
 
 
+class Document():
+    """
+    A file that's open in a tab. Only the current document is shown in
+    the viewer; the others just keep their commands, their undo history
+    and a little state for the viewer to put back when they're shown
+    again.
+    """
+    def __init__(self, file, fp, undoGroup):
+        self.file = file
+        self.fp = fp # file path, or None if it's never been saved
+        self.undoStack = QtWidgets.QUndoStack(undoGroup) # joins the group
+        self.undoStack.setUndoLimit(UndoLimit)
+        self.loader = None # FileLoader, while the file is being opened
+        self.loadPercent = 0
+        self.viewState = None # from CreditsViewer.viewState()
+
+    def name(self):
+        """
+        Return the name to show for the document
+        """
+        return os.path.basename(self.fp) if self.fp else 'Untitled'
+
+    def isModified(self):
+        """
+        Return True if the document has changes that haven't been saved
+        """
+        # A half-loaded file can't be saved anyway
+        return self.loader is None and not self.undoStack.isClean()
+
+    def close(self):
+        """
+        Stop loading the document, and let go of its undo history
+        """
+        if self.loader is not None:
+            self.loader.cancel()
+            self.loader = None
+        self.undoStack.deleteLater()
+
+
+
 class MainWindow(QtWidgets.QMainWindow):
-    def __init__(self):
+    def __init__(self, paths=()):
         super().__init__()
-        self.fp = None # file path
-
-        # Create the viewer
+        self.doc = None # the Document being shown
+
+        # Files are parsed only once, even if they're closed and opened
+        # again, or several files have the same contents
+        self.parseCache = ParseCache(ParseCacheLimit)
+
+        # Each document has its own undo stack, and the Edit menu's
+        # Undo and Redo follow whichever one is current
+        self.undoGroup = QtWidgets.QUndoGroup(self)
+
+        # Create the tab bar and the viewer. There's just one viewer,
+        # which shows whichever document's tab is selected.
+        self.tabs = QtWidgets.QTabBar()
+        self.tabs.setTabsClosable(True)
+        self.tabs.setMovable(True)
+        self.tabs.setDocumentMode(True)
+        self.tabs.setExpanding(False)
+        self.tabs.currentChanged.connect(self.handleTabChanged)
+        self.tabs.tabCloseRequested.connect(self.handleTabClose)
         self.view = CreditsViewer()
-        self.setCentralWidget(self.view)
+
+        central = QtWidgets.QWidget()
+        L = QtWidgets.QVBoxLayout(central)
+        L.setContentsMargins(0, 0, 0, 0)
+        L.setSpacing(0)
+        L.addWidget(self.tabs)
+        L.addWidget(self.view)
+        self.setCentralWidget(central)
+
+        # Create the loading progress widgets
+        self.loadProgress = QtWidgets.QProgressBar()
+        self.loadProgress.setMaximumWidth(192)
+        self.loadCancelBtn = QtWidgets.QPushButton('Cancel')
+        self.loadCancelBtn.clicked.connect(self.handleCancelLoad)
+        self.statusBar().addPermanentWidget(self.loadProgress)
+        self.statusBar().addPermanentWidget(self.loadCancelBtn)
+        self.loadProgress.hide()
+        self.loadCancelBtn.hide()
 
         # Create the menubar and a few actions
         self.createMenubar()
+        self.updateActions()
+
+        # Start opening any files given on the command line before the
+        # window is shown, so they're parsed while it comes up
+        for fp in paths: self.loadFile(fp)
 
         # Set window title and show the window
-        self.setWindowTitle('Newer Credits Editor')
+        self.updateTitle()
         self.show()
 
     def createMenubar(self):
@@ -890,18 +1547,50 @@ class MainWindow(QtWidgets.QMainWindow):
         self.saveAct = f.addAction('Save File')
         self.saveAct.setShortcut('Ctrl+S')
         self.saveAct.triggered.connect(self.handleSave)
-        self.saveAct.setEnabled(False)
 
         self.saveAsAct = f.addAction('Save File As...')
         self.saveAsAct.setShortcut('Ctrl+Shift+S')
         self.saveAsAct.triggered.connect(self.handleSaveAs)
-        self.saveAsAct.setEnabled(False)
+
+        self.closeAct = f.addAction('Close File')
+        self.closeAct.setShortcut(QtGui.QKeySequence.Close)
+        self.closeAct.triggered.connect(lambda: self.handleTabClose(self.tabs.currentIndex()))
 
         f.addSeparator()
 
         exitAct = f.addAction('Exit')
         exitAct.setShortcut('Ctrl+Q')
-        exitAct.triggered.connect(self.handleExit)
+        exitAct.triggered.connect(self.close)
+
+        # Edit Menu
+        e = m.addMenu('&Edit')
+
+        undoAct = self.undoGroup.createUndoAction(self)
+        undoAct.setShortcut(QtGui.QKeySequence.Undo)
+        e.addAction(undoAct)
+
+        redoAct = self.undoGroup.createRedoAction(self)
+        redoAct.setShortcut(QtGui.QKeySequence.Redo)
+        e.addAction(redoAct)
+
+        e.addSeparator()
+        e.addAction(self.view.cutAct)
+        e.addAction(self.view.copyAct)
+        e.addAction(self.view.pasteAct)
+        e.addAction(self.view.addAct)
+        e.addAction(self.view.deleteAct)
+
+        e.addSeparator()
+        e.addAction(self.view.moveUpAct)
+        e.addAction(self.view.moveDownAct)
+
+        e.addSeparator()
+        e.addAction(self.view.findAct)
+        e.addAction(self.view.findNextAct)
+        e.addAction(self.view.findPrevAct)
+
+        e.addSeparator()
+        e.addAction(self.view.nextProblemAct)
 
         # Help Menu
         h = m.addMenu('&Help')
@@ -911,63 +1600,294 @@ class MainWindow(QtWidgets.QMainWindow):
         aboutAct.triggered.connect(self.handleAbout)
 
 
+    def documents(self):
+        """
+        Return the open documents, in tab order
+        """
+        return [self.tabs.tabData(i) for i in range(self.tabs.count())]
+
+    def tabIndex(self, doc):
+        """
+        Return the index of a document's tab, or -1 if it's been closed
+        """
+        for i in range(self.tabs.count()):
+            if self.tabs.tabData(i) is doc: return i
+        return -1
+
+    def addDocument(self, doc):
+        """
+        Add a tab for a document, and show it
+        """
+        doc.undoStack.cleanChanged.connect(lambda clean: self.updateTab(doc))
+
+        # The first tab becomes current as soon as it's added, before
+        # it has a document to show
+        self.tabs.blockSignals(True)
+        i = self.tabs.addTab(doc.name())
+        self.tabs.setTabData(i, doc)
+        self.tabs.setTabToolTip(i, doc.fp or '')
+        self.tabs.blockSignals(False)
+
+        self.tabs.setCurrentIndex(i)
+        self.showDocument(doc)
+
+    def closeDocument(self, doc):
+        """
+        Close a document's tab, without asking about unsaved changes
+        """
+        i = self.tabIndex(doc)
+        if i == -1: return
+        if doc is self.doc: self.doc = None # nothing to remember
+        doc.close()
+        self.tabs.removeTab(i)
+        if not self.tabs.count(): self.showDocument(None)
+
+    def showDocument(self, doc):
+        """
+        Show a document (or nothing, if doc is None) in the viewer
+        """
+        if doc is not None and doc is self.doc: return
+
+        # Other documents don't keep any of the viewer's state, besides
+        # what's needed to put it back
+        if self.doc is not None:
+            self.doc.viewState = self.view.viewState()
+        self.doc = doc
+
+        if doc is None:
+            self.undoGroup.setActiveStack(None)
+            self.view.setFile(None)
+        else:
+            self.undoGroup.setActiveStack(doc.undoStack)
+            self.view.setFile(doc.file, doc.undoStack, doc.viewState)
+            doc.viewState = None
+
+        self.updateLoadWidgets()
+        self.updateActions()
+        self.updateTitle()
+
+    def handleTabChanged(self, index):
+        """
+        Show the document whose tab was selected
+        """
+        if index != -1: self.showDocument(self.tabs.tabData(index))
+
+    def handleTabClose(self, index):
+        """
+        Close a document's tab, after offering to save its changes
+        """
+        if index == -1: return
+        doc = self.tabs.tabData(index)
+        if self.maybeSave(doc): self.closeDocument(doc)
+
+    def updateTab(self, doc):
+        """
+        Update a document's tab, and the title bar if it's the current
+        one
+        """
+        i = self.tabIndex(doc)
+        if i == -1: return
+        self.tabs.setTabText(i, doc.name() + ('*' if doc.isModified() else ''))
+        self.tabs.setTabToolTip(i, doc.fp or '')
+        if doc is self.doc: self.updateTitle()
+
+    def updateTitle(self):
+        """
+        Show the current file's name, and whether it has unsaved
+        changes, in the title bar
+        """
+        if self.doc is None:
+            self.setWindowTitle('Newer Credits Editor')
+        else:
+            self.setWindowTitle(f'{self.doc.name()}[*] - Newer Credits Editor')
+        self.setWindowModified(self.doc is not None and self.doc.isModified())
+
+    def updateActions(self):
+        """
+        Enable the File menu actions that can be used on the current
+        document
+        """
+        # Saving a half-loaded file would lose the rest of it
+        doc = self.doc
+        canSave = doc is not None and doc.loader is None
+        self.saveAct.setEnabled(canSave and doc.fp is not None)
+        self.saveAsAct.setEnabled(canSave)
+        self.closeAct.setEnabled(doc is not None)
+
+    def updateLoadWidgets(self):
+        """
+        Show the loading progress of the current document, if it's
+        still being opened
+        """
+        loading = self.doc is not None and self.doc.loader is not None
+        self.loadProgress.setVisible(loading)
+        self.loadCancelBtn.setVisible(loading)
+        if loading:
+            self.loadProgress.setValue(self.doc.loadPercent)
+            self.statusBar().showMessage(f'Loading {self.doc.fp}...')
+        else:
+            self.statusBar().clearMessage()
+
+    def maybeSave(self, doc):
+        """
+        If a document has unsaved changes, ask whether to save them
+        first. Returns False if the user cancels.
+        """
+        if not doc.isModified(): return True
+
+        self.tabs.setCurrentIndex(self.tabIndex(doc))
+        answer = QtWidgets.QMessageBox.warning(self, 'Newer Credits Editor',
+            f'{doc.name()} has unsaved changes. Save them first?',
+            QtWidgets.QMessageBox.Save | QtWidgets.QMessageBox.Discard | QtWidgets.QMessageBox.Cancel,
+            QtWidgets.QMessageBox.Save)
+
+        if answer == QtWidgets.QMessageBox.Save:
+            return self.saveDocument(doc) if doc.fp is not None else self.saveDocumentAs(doc)
+        return answer == QtWidgets.QMessageBox.Discard
+
     def handleNew(self):
         """
         Handle creating a new file
         """
-        f = NewerStaffRollBin()
-        self.view.setFile(f)
-        self.saveAsAct.setEnabled(True)
+        self.addDocument(Document(NewerStaffRollBin(), None, self.undoGroup))
 
     def handleOpen(self):
         """
         Handle file opening
         """
-        fp = QtWidgets.QFileDialog.getOpenFileName(self, 'Open File', '', 'Binary Files (*.bin);;All Files (*)')[0]
-        if fp == '': return
-        self.fp = fp
+        fps = QtWidgets.QFileDialog.getOpenFileNames(self, 'Open File', '', 'Binary Files (*.bin);;All Files (*)')[0]
+        for fp in fps: self.loadFile(fp)
 
-        # Open the file
-        with open(fp, 'rb') as f:
-            data = f.read()
+    def loadFile(self, fp):
+        """
+        Start opening a file in a new tab (or switch to its tab, if it's
+        already open). It's parsed in the background, and the viewer
+        fills up as commands arrive.
+        """
+        for doc in self.documents():
+            if doc.fp is not None and os.path.normcase(os.path.abspath(doc.fp)) == os.path.normcase(os.path.abspath(fp)):
+                self.tabs.setCurrentIndex(self.tabIndex(doc))
+                return
+
+        doc = Document(NewerStaffRollBin(), fp, self.undoGroup)
+        loader = FileLoader(fp, self.parseCache)
+        loader.signals.commandsLoaded.connect(lambda coms: self.handleCommandsLoaded(doc, loader, coms))
+        loader.signals.progress.connect(lambda done, total: self.handleLoadProgress(doc, loader, done, total))
+        loader.signals.finished.connect(lambda: self.handleLoadFinished(doc, loader))
+        loader.signals.failed.connect(lambda msg: self.handleLoadFailed(doc, loader, msg))
+        doc.loader = loader
+        self.addDocument(doc)
+        QtCore.QThreadPool.globalInstance().start(loader)
+
+    def handleCommandsLoaded(self, doc, loader, coms):
+        """
+        Handle a chunk of commands arriving from a FileLoader
+        """
+        if loader is not doc.loader: return # cancelled
+        if doc is self.doc:
+            self.view.model.appendCommands(coms)
+        else:
+            doc.file.Commands.extend(coms)
 
-        M = NewerStaffRollBin(data)
+    def handleLoadProgress(self, doc, loader, done, total):
+        """
+        Update the loading progress bar
+        """
+        if loader is not doc.loader: return
+        doc.loadPercent = done * 100 // max(total, 1)
+        if doc is self.doc: self.loadProgress.setValue(doc.loadPercent)
 
-        # Update the viewer with this data
-        self.view.setFile(M)
+    def handleLoadFinished(self, doc, loader):
+        """
+        Handle a FileLoader finishing
+        """
+        if loader is not doc.loader: return
+        doc.loader = None
+        self.updateTab(doc)
+        if doc is self.doc:
+            self.updateLoadWidgets()
+            self.updateActions()
+
+    def handleLoadFailed(self, doc, loader, msg):
+        """
+        Handle a FileLoader running into an error
+        """
+        if loader is not doc.loader: return
+        self.closeDocument(doc)
+        QtWidgets.QMessageBox.critical(self, 'Open File', f'{doc.fp} could not be opened:\n{msg}')
 
-        # Enable saving
-        self.saveAct.setEnabled(True)
-        self.saveAsAct.setEnabled(True)
+    def handleCancelLoad(self):
+        """
+        Stop loading the current document, and close it
+        """
+        if self.doc is not None and self.doc.loader is not None:
+            self.closeDocument(self.doc)
 
     def handleSave(self):
         """
         Handle file saving
         """
-        data = self.view.saveFile()
-
-        with open(self.fp, 'wb') as f:
-            f.write(data)
+        if self.doc is not None: self.saveDocument(self.doc)
 
     def handleSaveAs(self):
         """
         Handle saving to a new file
         """
+        if self.doc is not None: self.saveDocumentAs(self.doc)
+
+    def saveDocument(self, doc):
+        """
+        Save a document to its file. Returns True if it worked.
+        """
+        try:
+            data = doc.file.save()
+        except ValueError as e:
+            QtWidgets.QMessageBox.critical(self, 'Save File', f'The file could not be saved:\n{e}')
+            return False
+
+        # If the game (or anything else) reads the file while it's being
+        # saved, or the editor crashes partway through, it'll see either
+        # the old file or the new one, never half of one
+        try:
+            written = writeFileAtomically(doc.fp, data)
+        except OSError as e:
+            QtWidgets.QMessageBox.critical(self, 'Save File', f'{doc.fp} could not be saved:\n{e}')
+            return False
+
+        doc.undoStack.setClean()
+        self.updateTab(doc)
+        self.statusBar().showMessage(f'Saved {doc.fp}' if written else f'{doc.fp} is already up to date', 3000)
+        return True
+
+    def saveDocumentAs(self, doc):
+        """
+        Save a document to a new file. Returns True if it worked.
+        """
         fp = QtWidgets.QFileDialog.getSaveFileName(self, 'Save File', '', 'Binary Files (*.bin);;All Files (*)')[0]
-        if fp == '': return
-        self.fp = fp
+        if fp == '': return False
 
-        # Save it
-        self.handleSave()
+        # Save it, and keep using the old path if that fails
+        oldFp, doc.fp = doc.fp, fp
+        if not self.saveDocument(doc):
+            doc.fp = oldFp
+            return False
 
-        # Enable saving
-        self.saveAct.setEnabled(True)
+        self.updateTab(doc)
+        self.updateActions()
+        return True
 
-    def handleExit(self):
+    def closeEvent(self, event):
         """
-        Exit the editor
+        Offer to save unsaved changes before closing
         """
-        raise SystemExit
+        docs = self.documents()
+        for doc in docs:
+            if not self.maybeSave(doc):
+                event.ignore()
+                return
+
+        for doc in docs: doc.close()
+        event.accept()
 
     def handleAbout(self):
         """
@@ -1007,7 +1927,10 @@ def main(argv):
     Main startup function
     """
     app = QtWidgets.QApplication(argv)
-    mainWindow = MainWindow()
+
+    # Files to open can be given on the command line (Qt's own options
+    # are left out of app.arguments())
+    mainWindow = MainWindow(app.arguments()[1:])
     sys.exit(app.exec_())
 
 if __name__ == '__main__': main(sys.argv)
@@ -0,0 +1,2269 @@
+#!/usr/bin/python
+# -*- coding: latin-1 -*-
+
+# Newer Credits Editor - Edits NewerSMBW's StaffRoll.bin
+# Version 1.3
+# Copyright (C) 2013-2017 RoadrunnerWMC
+
+# This file is part of Newer Credits Editor.
+
+# Newer Credits Editor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Newer Credits Editor is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Newer Credits Editor.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# staffroll.py
+# Reads and writes StaffRoll.bin. This module doesn't depend on Qt, so
+# it can be used without a display.
+
+
+################################################################
+################################################################
+
+
+# The editor imports this module while it starts up, so modules only
+# needed by the command-line tools or when saving (argparse,
+# concurrent.futures, difflib, tempfile) are imported where they're used
+import array
+import bisect
+import codecs
+import collections
+import hashlib
+import itertools
+import json
+import mmap
+import operator
+import os, os.path
+import re
+import stat
+import struct
+import sys
+import threading
+
+
+# Encoding of the text in Set Text commands. The game's font only covers
+# Latin-1, but engine forks with other fonts can change this.
+TextEncoding = 'latin-1'
+
+
+def setTextEncoding(encoding):
+    """
+    Change the encoding used for Set Text commands
+    """
+    global TextEncoding
+    TextEncoding = codecs.lookup(encoding).name
+
+
+# The game runs at 60 frames per second
+FramesPerSecond = 60
+
+# Switch Scene and Wait waits for the scene transition to finish rather
+# than for a fixed time. The timeline counts it as this many frames, so
+# times after one are only minimums (see Timeline.isMinimum()).
+SceneSwitchWaitFrames = 0
+
+
+
+################################################################
+################################################################
+################################################################
+########################### Commands ###########################
+
+
+class FieldKind():
+    """
+    How one of a command's fields is stored in the file, and edited.
+    A command's data starts with all of its fixed-size values (numbers,
+    and the lengths of length-prefixed strings), packed big-endian in
+    the order of its fields. After those come its strings, in order,
+    each encoded in TextEncoding and followed by a null byte.
+    """
+    def __init__(self, name, format=None, prefixed=False, multiline=False):
+        self.name = name
+        self.format = format # struct format of an unsigned number, or None for a string
+        self.isString = format is None
+        self.prefixed = prefixed # the string's length (plus its null byte) is stored as a u8
+        self.multiline = multiline # edited with a multi-line text box
+        self.maximum = None if self.isString else (1 << (8 * struct.calcsize('>' + format))) - 1
+        self.default = '' if self.isString else 0
+
+    def __repr__(self):
+        return self.name
+
+
+U8 = FieldKind('u8', 'B')
+U16BE = FieldKind('u16be', 'H')
+PString = FieldKind('pstring', prefixed=True) # length-prefixed string
+CString = FieldKind('cstring') # null-terminated string
+CText = FieldKind('ctext', multiline=True) # null-terminated string with several lines
+
+
+class Command():
+    """
+    Base class for all commands. Subclasses describe their data with
+    `fields` (and `computed`), and are read, written and edited from
+    that; see FieldKind.
+    """
+    name = ''
+    description = ''
+
+    # How many frames the credits wait after running this command
+    duration = 0
+
+    # (attribute, label, kind) for each value the command holds, where
+    # kind is a FieldKind. Each attribute also needs to be in
+    # __slots__.
+    fields = ()
+
+    # (kind, function) for each value that's stored after the fields'
+    # fixed-size values but worked out from the others, rather than
+    # edited. They're ignored when reading.
+    computed = ()
+
+    # Short description of the command's values for the command list,
+    # filled in with the fields by str.format(), such as
+    # 'to Scene ID {scene}'
+    summary = None
+
+    # Commands are small and there can be a lot of them, so they use
+    # __slots__ instead of a __dict__. _encoded is the command's
+    # complete encoded form, as returned by asBytes(). It's cleared
+    # whenever any attribute is changed.
+    __slots__ = ('_encoded',)
+
+    # Commands without fields are all identical, so each of those types
+    # only ever has one instance, which is shared
+    _sharedInstances = {}
+
+    # Made from the fields by _compileCodec()
+    _header = struct.Struct('>')
+    _layout = ()
+    _setters = ()
+    _encode = staticmethod(lambda com: b'')
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._compileCodec()
+
+    @classmethod
+    def _compileCodec(cls):
+        """
+        Work out how to read and write this type of command from its
+        fields, so that fromData() and asData() only have to run a
+        precompiled struct and fill in the strings
+        """
+        formats = []
+        for attr, label, kind in cls.fields:
+            if not kind.isString:
+                formats.append(kind.format)
+            elif kind.prefixed:
+                formats.append('B')
+        formats.extend(kind.format for kind, function in cls.computed)
+        cls._header = struct.Struct('>' + ''.join(formats))
+
+        # Slots are filled in directly when reading, which skips
+        # __setattr__()
+        def setter(attr):
+            descriptor = getattr(cls, attr, None)
+            if hasattr(descriptor, '__set__'): return descriptor.__set__
+            return lambda com, value: object.__setattr__(com, attr, value)
+        cls._setters = tuple(setter(attr) for attr, label, kind in cls.fields)
+        cls._layout = tuple((attr, kind, setField) for (attr, label, kind), setField in zip(cls.fields, cls._setters))
+        cls._hasStrings = any(kind.isString for attr, label, kind in cls.fields)
+
+        # Commands with only numbers are just packed
+        pack = cls._header.pack
+        if not cls.fields:
+            encode = lambda com: b''
+        elif not cls._hasStrings and not cls.computed:
+            getValues = operator.attrgetter(*(attr for attr, label, kind in cls.fields))
+            if len(cls.fields) == 1:
+                encode = lambda com: pack(getValues(com))
+            else:
+                encode = lambda com: pack(*getValues(com))
+        else:
+            cls._encodeLayout = tuple((attr, kind.isString, kind.prefixed) for attr, label, kind in cls.fields)
+            encode = cls._encodeWithStrings
+        cls._encode = staticmethod(encode)
+
+    def __new__(cls):
+        if cls.fields: return super().__new__(cls)
+        try:
+            return cls._sharedInstances[cls]
+        except KeyError:
+            com = cls._sharedInstances[cls] = super().__new__(cls)
+            return com
+
+    def __init__(self):
+        self._encoded = None
+        for attr, label, kind in self.fields:
+            setattr(self, attr, kind.default)
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name != '_encoded':
+            super().__setattr__('_encoded', None)
+
+    @classmethod
+    def fromData(cls, data):
+        """
+        Create a Command instance based on some data (everything after
+        the opcode)
+        """
+        if not cls.fields: return cls()
+        try:
+            values = cls._header.unpack_from(data)
+        except struct.error:
+            raise ValueError(f'{cls.name} command is too short') from None
+
+        com = object.__new__(cls)
+        _setEncoded(com, None)
+        if not cls._hasStrings:
+            for setField, value in zip(cls._setters, values): setField(com, value)
+            return com
+
+        data = bytes(data)
+        values = iter(values)
+        pos = cls._header.size
+        for attr, kind, setField in cls._layout:
+            if not kind.isString:
+                setField(com, next(values))
+                continue
+
+            if kind.prefixed:
+                end = pos + next(values)
+                if end > len(data):
+                    raise ValueError(f'{cls.name} command\'s {attr} runs past its end')
+                s = data[pos:end - 1]
+            else:
+                end = data.find(0, pos) + 1
+                if not end:
+                    raise ValueError(f'{cls.name} command has no null terminator after its {attr}')
+                s = data[pos:end - 1]
+            pos = end
+
+            s = s.decode(TextEncoding)
+            # Single-line strings (like Set Text titles: "Programming",
+            # "Special Thanks"...) repeat a lot, so share them
+            setField(com, s if kind.multiline else sys.intern(s))
+        return com
+
+    def copy(self):
+        """
+        Return a copy of the command. Commands without fields are
+        shared, so those are returned as they are.
+        """
+        if not self.fields: return self
+        com = type(self)()
+        for attr, label, kind in self.fields:
+            setattr(com, attr, getattr(self, attr))
+        return com
+
+    def asData(self):
+        """
+        Return the command's data (everything after the opcode) based on
+        its current settings
+        """
+        try:
+            return self._encode(self)
+        except struct.error:
+            raise ValueError(f'{self.name} command has a value that\'s out of range') from None
+
+    def _encodeWithStrings(self):
+        """
+        asData() for commands with strings or computed values
+        """
+        values = []
+        strings = []
+        for attr, isString, prefixed in self._encodeLayout:
+            value = getattr(self, attr)
+            if not isString:
+                values.append(value)
+                continue
+            s = self.encodeText(value, attr) + b'\0'
+            if prefixed: values.append(len(s))
+            strings.append(s)
+        for kind, function in self.computed:
+            values.append(function(self))
+        strings.insert(0, self._header.pack(*values))
+        return b''.join(strings)
+
+    @classmethod
+    def encodeText(cls, s, what):
+        """
+        Encode a string field, or raise ValueError if it has characters
+        the game can't display
+        """
+        s = s.replace('\0', '')
+        try:
+            return s.encode(TextEncoding)
+        except UnicodeEncodeError as e:
+            raise ValueError(f'{cls.name} {what} contains {s[e.start]!r}, '
+                f'which can\'t be encoded as {TextEncoding}') from None
+
+    @property
+    def dynamicDescription(self):
+        """
+        The summary, filled in with the command's values (or None)
+        """
+        if self.summary is None: return None
+        return self.summary.format_map({attr: getattr(self, attr) for attr, label, kind in self.fields})
+
+    def asBytes(self):
+        """
+        Return the command encoded as it appears in the file, including
+        its length byte and opcode
+        """
+        if self._encoded is None:
+            comdata = self.asData()
+            if len(comdata) + 2 > 0xFF:
+                raise ValueError(f'{self.name} command is too long to be saved')
+            try:
+                _setEncoded(self, bytes((len(comdata) + 2, IdsByCommand[type(self)])) + comdata)
+            except KeyError:
+                raise ValueError(f'Could not find ID of command: {self}')
+        return self._encoded
+
+
+# Sets a command's _encoded without going through __setattr__()
+_setEncoded = Command._encoded.__set__
+
+
+class DelayCommand(Command):
+    """
+    Command which indicates a delay
+    """
+    __slots__ = ('delay',)
+    name = 'Wait'
+    description = 'Causes a delay before the next command is processed.'
+    fields = (('delay', 'Time (in frames):', U16BE),)
+
+    @property
+    def duration(self):
+        return self.delay
+
+    @property
+    def dynamicDescription(self):
+        n = self.delay
+        return 'for 1 frame' if n == 1 else f'for {n} frames'
+
+
+class SwitchSceneCommand(Command):
+    """
+    Command which indicates a scene switch
+    """
+    __slots__ = ('scene',)
+    name = 'Switch Scene'
+    description = 'Causes the level to switch to another zone.'
+    fields = (('scene', 'Scene ID:', U8),)
+    summary = 'to Scene ID {scene}'
+
+
+class SwitchSceneAndWaitCommand(SwitchSceneCommand):
+    """
+    Command which indicates a scene switch and then wait
+    """
+    __slots__ = ()
+    name = 'Switch Scene and Wait'
+    description = 'Causes the level to switch to another zone and then wait.'
+
+    @property
+    def duration(self):
+        return SceneSwitchWaitFrames
+
+
+class ShowScoresCommand(Command):
+    """
+    Command which causes the scores to be displayed
+    """
+    __slots__ = ()
+    name = 'Show Coin Counters'
+    description = 'Causes the coin counters to become visible.'
+
+
+class ShowTextCommand(Command):
+    """
+    Command which causes the current text to be displayed
+    """
+    __slots__ = ()
+    name = 'Show Text'
+    description = 'Causes the current text to fade onto the screen.'
+
+
+class HideTextCommand(Command):
+    """
+    Command which causes the current text to be hidden
+    """
+    __slots__ = ()
+    name = 'Hide Text'
+    description = 'Causes the current text to fade out.'
+
+
+class SetTextCommand(Command):
+    """
+    Command which sets the current text
+    """
+    __slots__ = ('title', 'text')
+    name = 'Set Text'
+    description = 'Changes the current text.'
+    fields = (('title', 'Title:', PString), ('text', 'Text:', CText))
+    # The number of lines of text follows the title's length. The game
+    # works it out for itself, so it's ignored when reading.
+    computed = ((U8, lambda com: com.text.count('\n') + 1),)
+    summary = 'to "{title}"'
+
+
+class ShowTitleCommand(Command):
+    """
+    Command which causes the title to be displayed
+    """
+    __slots__ = ()
+    name = 'Show Titlescreen Logo'
+    description = 'Causes the titlescreen logo to become visible.'
+
+
+class HideTitleCommand(Command):
+    """
+    Command which causes the title to be hidden
+    """
+    __slots__ = ()
+    name = 'Hide Titlescreen Logo'
+    description = 'Hides the titlescreen logo.'
+
+
+class PlayTitleAnimationCommand(Command):
+    """
+    Command which causes the title anim to be played
+    """
+    __slots__ = ('animation',)
+    name = 'Play Titlescreen Logo Animation'
+    description = 'Plays a titlescreen logo animation.'
+    fields = (('animation', 'Animation ID:', U8),)
+    summary = 'animation {animation}'
+
+
+class EnableEndingModeCommand(Command):
+    """
+    Command which causes the ending mode to be enabled
+    """
+    __slots__ = ()
+    name = 'Enable Ending Mode'
+    description = ('Enables the ending mode. '
+        'The ending mode disables Wii remote input for player control.')
+
+
+class SpawnZoomCommand(Command):
+    """
+    Command which does something unknown
+    """
+    __slots__ = ()
+    name = 'Spawn Zoom'
+    description = 'Spawns a hardcoded zoom actor in the stage.'
+
+
+class PlayPlayerWinAnimationsCommand(Command):
+    """
+    Command which causes the player win animations to be played
+    """
+    __slots__ = ()
+    name = 'Play Player Win Animations'
+    description = 'Plays an animation for the player with the most coins.'
+
+
+class DestroyZoomCommand(Command):
+    """
+    Command which does something unknown
+    """
+    __slots__ = ()
+    name = 'Destroy Zoom'
+    description = 'Despawns a previously spawned zoom actor.'
+
+
+class PlayersLookUpCommand(Command):
+    """
+    Command which causes the players to look up
+    """
+    __slots__ = ()
+    name = 'Players Look Up'
+    description = 'Causes all players to look upward.'
+
+
+class TheEndCommand(Command):
+    """
+    Command which causes 'The End' to be displayed
+    """
+    __slots__ = ()
+    name = 'Display "The End"'
+    description = 'Causes "The End" to appear on the screen.'
+
+
+class EndCreditsCommand(Command):
+    """
+    Command which causes the credits to end
+    """
+    __slots__ = ()
+    name = 'End Credits'
+    description = 'End the credits.'
+
+
+class HideTheEndCommand(Command):
+    """
+    Command which causes 'The End' to be hidden
+    """
+    __slots__ = ()
+    name = 'Hide "The End"'
+    description = 'Causes "The End" to fade out.'
+
+
+class BeginFireworksCommand(Command):
+    """
+    Command which causes fireworks to begin
+    """
+    __slots__ = ()
+    name = 'Begin Fireworks'
+    description = 'Causes fireworks to begin in the background.'
+
+
+class EndFireworksCommand(Command):
+    """
+    Command which causes fireworks to end
+    """
+    __slots__ = ()
+    name = 'End Fireworks'
+    description = 'Causes the background fireworks to end.'
+
+
+
+CommandsById = {
+    0x01: DelayCommand,
+    0x02: SwitchSceneCommand,
+    0x03: SwitchSceneAndWaitCommand,
+    0x04: ShowScoresCommand,
+    0x05: ShowTextCommand,
+    0x06: HideTextCommand,
+    0x07: SetTextCommand,
+    0x08: ShowTitleCommand,
+    0x09: HideTitleCommand,
+    0x0A: PlayTitleAnimationCommand,
+    0x0B: EnableEndingModeCommand,
+    0x0C: SpawnZoomCommand,
+    0x0D: PlayPlayerWinAnimationsCommand,
+    0x0E: DestroyZoomCommand,
+    0x0F: PlayersLookUpCommand,
+    0x10: TheEndCommand,
+    0x11: EndCreditsCommand,
+    0x12: HideTheEndCommand,
+    0x13: BeginFireworksCommand,
+    0x14: EndFireworksCommand,
+    }
+IdsByCommand = {com: id for id, com in CommandsById.items()}
+
+
+def addCommandType(opcode, name, description, fields=(), summary=None):
+    """
+    Make a new type of command (such as one added by an engine fork)
+    from a description of its fields, and register it under an opcode
+    so that it can be read, saved and edited like the others. Returns
+    the new Command subclass.
+
+    For example:
+    addCommandType(0x15, 'Play Sound', 'Plays a sound effect.',
+        (('sound', 'Sound ID:', U16BE),), 'sound {sound}')
+    """
+    if not 0 < opcode <= 0xFF:
+        raise ValueError(f'Opcode 0x{opcode:X} is out of range')
+    if opcode in CommandsById:
+        raise ValueError(f'Opcode 0x{opcode:02X} is already {CommandsById[opcode].name}')
+    attrs = [attr for attr, label, kind in fields]
+    for i, attr in enumerate(attrs):
+        if not attr.isidentifier():
+            raise ValueError(f'Field name {attr!r} isn\'t a valid identifier')
+        if hasattr(Command, attr):
+            raise ValueError(f'Field name {attr!r} is already used by Command')
+        if attr in attrs[:i]:
+            raise ValueError(f'Field name {attr!r} is used more than once')
+
+    className = ''.join(word.capitalize() for word in re.findall(r'\w+', name)) + 'Command'
+    cls = type(className, (Command,), {
+        '__doc__': description,
+        '__module__': __name__,
+        '__slots__': tuple(attrs),
+        'name': name,
+        'description': description,
+        'fields': tuple(fields),
+        'summary': summary,
+        })
+    CommandsById[opcode] = cls
+    IdsByCommand[cls] = opcode
+    return cls
+
+
+def CommandFromData(data):
+    """
+    Return a command from data
+    """
+    return CommandsById[data[0]].fromData(data[1:])
+
+
+def iterCommands(buffer):
+    """
+    Iterate over the commands in some raw file data, without copying
+    it. Yields (opcode, offset, payload) for each command, where offset
+    is the position of the command in the data and payload is a
+    memoryview of its arguments. Stops at the null command.
+    """
+    view = memoryview(buffer).cast('B')
+
+    # No headers. Each command is a length byte (which counts itself
+    # and the opcode), an opcode and then the arguments.
+    i = 0
+    end = len(view)
+    while True:
+        if i + 2 > end:
+            raise ValueError(f'Data ends at offset {i} without a null command')
+        length = view[i]
+        opcode = view[i + 1]
+        if opcode == 0: return
+        if length < 2 or i + length > end:
+            raise ValueError(f'Invalid command length {length} at offset {i}')
+        if opcode not in CommandsById:
+            raise ValueError(f'Unknown opcode 0x{opcode:02X} at offset {i}')
+
+        yield opcode, i, view[i + 2:i + length]
+        i += length
+
+
+def mapFile(path):
+    """
+    Return a read-only mmap of a file, or its contents if it's empty
+    (empty files can't be mapped). The mapping is closed once nothing
+    refers to it anymore.
+    """
+    with open(path, 'rb') as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return f.read()
+
+
+def writeFileAtomically(path, data):
+    """
+    Write data to a file without ever leaving a half-written file
+    behind: it's written to a temporary file in the same folder, flushed
+    to disk and then renamed over the original. Does nothing if the file
+    already contains exactly this data. Returns whether the file was
+    written.
+    """
+    path = os.path.realpath(path) # replace a symlink's target, not the link
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, 'rb') as f:
+                if f.read() == data: return False
+    except FileNotFoundError:
+        pass
+
+    import tempfile
+    directory = os.path.dirname(path)
+    fd, tempPath = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # mkstemp() makes files only their owner can read, so give it the
+        # original file's permissions (or the usual ones for a new file)
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(tempPath, mode)
+
+        os.replace(tempPath, path)
+    except BaseException:
+        try:
+            os.remove(tempPath)
+        except OSError:
+            pass
+        raise
+
+    # Make sure the rename itself reaches the disk (folders can't be
+    # opened like this on Windows)
+    if os.name == 'posix':
+        dirFd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dirFd)
+        finally:
+            os.close(dirFd)
+
+    return True
+
+
+class NewerStaffRollBin():
+    """
+    Class which represents NewerStaffRoll.bin
+    """
+    def __init__(self, data=None):
+        self.Commands = []
+        if data is not None: self._initFromData(data)
+
+    @classmethod
+    def fromFile(cls, path):
+        """
+        Load a NewerStaffRollBin from a file, mapping it into memory
+        instead of reading it all in first
+        """
+        return cls(mapFile(path))
+
+    def _initFromData(self, data):
+        """
+        Initialise the NewerStaffRollBin from raw file data
+        """
+        with memoryview(data) as view:
+            self.Commands = [CommandsById[opcode].fromData(payload)
+                for opcode, offset, payload in iterCommands(view)]
+
+
+    def save(self):
+        """
+        Convert self.commands to bytes that can be saved
+        """
+        encoded = [com.asBytes() for com in self.Commands]
+
+        data = bytearray(sum(len(e) for e in encoded) + 2)
+        i = 0
+        for e in encoded:
+            data[i:i + len(e)] = e
+            i += len(e)
+        data[i:] = b'\x02\x00' # null command
+
+        return bytes(data)
+
+
+
+################################################################
+################################################################
+################################################################
+########################## Parse Cache #########################
+
+
+class ParseCache():
+    """
+    Least-recently-used cache of parsed files, keyed by a hash of their
+    contents, so that opening the same data again (or another file with
+    the same contents) doesn't parse it again. The cached commands are
+    shared by everything that loads that data, so they mustn't be
+    changed in place: replace them with edited copies (Command.copy())
+    instead. Can be used from multiple threads.
+    """
+    # Rough memory cost of a parsed command, not counting its text
+    # (see bytes_per_command in benchmark.py)
+    CommandBytes = 64
+
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.totalBytes = 0
+        self.hits = self.misses = 0
+        self._entries = collections.OrderedDict() # key: (commands, cost), oldest first
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(data):
+        """
+        Return the key of some file data
+        """
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+    def get(self, key):
+        """
+        Return the cached commands (as a tuple) for a key, or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, commands, size):
+        """
+        Cache the commands parsed from `size` bytes of data
+        """
+        cost = size + len(commands) * self.CommandBytes
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None: self.totalBytes -= old[1]
+            if cost > self.maxBytes: return
+            self._entries[key] = (tuple(commands), cost)
+            self.totalBytes += cost
+            self._evict()
+
+    def setMaxBytes(self, maxBytes):
+        """
+        Change how much memory (roughly) the cache can use
+        """
+        with self._lock:
+            self.maxBytes = maxBytes
+            self._evict()
+
+    def clear(self):
+        """
+        Forget everything
+        """
+        with self._lock:
+            self._entries.clear()
+            self.totalBytes = 0
+
+    def _evict(self):
+        """
+        Forget the least recently used files until the cache fits
+        """
+        while self.totalBytes > self.maxBytes:
+            key, (commands, cost) = self._entries.popitem(last=False)
+            self.totalBytes -= cost
+
+    def load(self, data):
+        """
+        Return a NewerStaffRollBin of some file data, which is only
+        parsed if it isn't cached
+        """
+        key = self.key(data)
+        commands = self.get(key)
+        if commands is None:
+            commands = NewerStaffRollBin(data).Commands
+            self.put(key, commands, len(data))
+
+        f = NewerStaffRollBin()
+        f.Commands = list(commands)
+        return f
+
+
+def defaultCacheDir():
+    """
+    Return the usual folder for DiskCache's files on this system
+    """
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'NewerCreditsEditor')
+
+
+def commandSchema():
+    """
+    Return a short hash of every command type's opcode, name and
+    fields, which changes whenever files would be parsed differently
+    """
+    schema = repr([(opcode, cls.__name__, cls.fields)
+        for opcode, cls in sorted(CommandsById.items())])
+    return hashlib.blake2b(schema.encode('utf-8'), digest_size=8).digest()
+
+
+class DiskCache():
+    """
+    Persistent cache of parsed files, so that tools run over the same
+    files again don't have to parse them again. Each file's commands are
+    kept in their own cache file, named after the file's path.
+
+    An entry is used if the file's size and modification time haven't
+    changed. If only the modification time has, the file's contents
+    are hashed and compared instead. Entries also record the text
+    encoding and command types they were made with, and are ignored if
+    those have changed.
+
+    Cache files are laid out as:
+        header (DiskCache.Header)
+        meta: the text encoding and the file's path, in UTF-8, separated
+            by a null character
+        opcodes: one byte per command
+        ints: every integer field of every command, in order (u16)
+        string refs: every string field of every command, in order, as
+            an index into the string table (u32)
+        string lengths: the length in characters of every distinct
+            string (u32)
+        string table: every distinct string, in UTF-8, one after another
+            (lengths are stored instead of separators, since strings
+            can contain any character, null included)
+    All numbers are little-endian.
+    """
+    Magic = b'NSRC'
+    Version = 2
+    Extension = '.nsrcache'
+
+    # magic, version, schema, file size, file mtime (ns), content hash,
+    # command count, int count, string ref count, string count, string
+    # table length, meta length
+    Header = struct.Struct('<4sH8sQQ16sIIIIII')
+
+    def __init__(self, directory=None, maxBytes=256 * 1024 * 1024):
+        self.directory = directory or defaultCacheDir()
+        self.maxBytes = maxBytes
+        self.hits = self.misses = 0
+
+    def entryPath(self, path):
+        """
+        Return the path of the cache file for a file
+        """
+        name = hashlib.blake2b(os.path.abspath(path).encode('utf-8', 'surrogateescape'), digest_size=16).hexdigest()
+        return os.path.join(self.directory, name + self.Extension)
+
+    @staticmethod
+    def meta(path):
+        """
+        Return the text encoding and absolute path a cache file has to
+        match, as bytes
+        """
+        # Normalized, so 'latin-1' and 'iso8859-1' match
+        encoding = codecs.lookup(TextEncoding).name
+        return f'{encoding}\0{os.path.abspath(path)}'.encode('utf-8', 'surrogateescape')
+
+    def load(self, path):
+        """
+        Return the commands in a file, from the cache if they're there
+        and still up to date. Otherwise the file is parsed, and cached
+        for next time.
+        """
+        # Stat before reading, so that if the file changes in between,
+        # the cache entry looks out of date next time
+        st = os.stat(path)
+        coms = self.get(path, st)
+        if coms is not None:
+            self.hits += 1
+            return coms
+        self.misses += 1
+
+        data = mapFile(path)
+        coms = NewerStaffRollBin(data).Commands
+        try:
+            self.put(path, st, ParseCache.key(data), coms)
+        except OSError:
+            pass # caching is optional
+        return coms
+
+    def get(self, path, st):
+        """
+        Return the cached commands of a file, given its os.stat(), or
+        None if they aren't cached or are out of date
+        """
+        entryPath = self.entryPath(path)
+        try:
+            with open(entryPath, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        try:
+            (magic, version, schema, size, mtime, contentHash, count, intCount,
+                refCount, stringCount, tableLength, metaLength) = self.Header.unpack_from(data)
+        except struct.error:
+            return None
+        if magic != self.Magic or version != self.Version or schema != commandSchema():
+            return None
+        if (count + intCount * 2 + (refCount + stringCount) * 4 + tableLength
+                + metaLength + self.Header.size != len(data)):
+            return None
+
+        i = self.Header.size
+        if data[i:i + metaLength] != self.meta(path):
+            return None
+        if size != st.st_size:
+            return None
+
+        if mtime != st.st_mtime_ns:
+            # Touched, but maybe not changed
+            if ParseCache.key(mapFile(path)) != contentHash: return None
+            try:
+                self.put(path, st, contentHash, None, data)
+            except OSError:
+                pass
+
+        i += metaLength
+        opcodes = data[i:i + count]
+        i += count
+        ints = array.array('H', data[i:i + intCount * 2])
+        i += intCount * 2
+        refs = array.array('I', data[i:i + refCount * 4])
+        i += refCount * 4
+        lengths = array.array('I', data[i:i + stringCount * 4])
+        i += stringCount * 4
+        try:
+            text = data[i:].decode('utf-8')
+        except UnicodeDecodeError:
+            return None # damaged
+        if sys.byteorder == 'big':
+            ints.byteswap()
+            refs.byteswap()
+            lengths.byteswap()
+        ends = list(itertools.accumulate(lengths))
+        if (ends[-1] if ends else 0) != len(text):
+            return None # damaged
+        table = [text[start:end] for start, end in zip([0] + ends, ends)]
+
+        try:
+            coms = self._commandsFromArrays(opcodes, ints, refs, table)
+        except (KeyError, IndexError, StopIteration):
+            return None # damaged
+
+        # Only use it now that it's been read successfully
+        try:
+            os.utime(entryPath)
+        except OSError:
+            pass
+        return coms
+
+    @staticmethod
+    def _commandsFromArrays(opcodes, ints, refs, table):
+        """
+        Rebuild a list of commands from the arrays in a cache file
+        """
+        # This is most of the time a cache hit takes, so the commands'
+        # slots are filled in directly, skipping __init__() and
+        # __setattr__()
+        ints = iter(ints)
+        refs = iter(refs)
+        stringSetter = lambda setter: lambda com: setter(com, table[next(refs)])
+        intSetter = lambda setter: lambda com: setter(com, next(ints))
+        shared = {}
+        setters = {}
+        for opcode, cls in CommandsById.items():
+            if not cls.fields:
+                shared[opcode] = cls()
+                continue
+            setters[opcode] = (cls, [
+                (stringSetter if kind.isString else intSetter)(setField)
+                for (attr, label, kind), setField in zip(cls.fields, cls._setters)])
+
+        newCommand = object.__new__
+        setEncoded = _setEncoded
+        coms = []
+        append = coms.append
+        for opcode in opcodes:
+            com = shared.get(opcode)
+            if com is None:
+                cls, fieldSetters = setters[opcode]
+                com = newCommand(cls)
+                setEncoded(com, None)
+                for setField in fieldSetters: setField(com)
+            append(com)
+        return coms
+
+    def put(self, path, st, contentHash, coms, data=None):
+        """
+        Cache the commands of a file, given its os.stat() and content
+        hash (ParseCache.key()). If data (an existing cache file) is
+        given instead of coms, only its size and modification time are
+        updated.
+        """
+        if data is None:
+            opcodes = bytearray()
+            ints = array.array('H')
+            refs = array.array('I')
+            strings = {}
+            for com in coms:
+                opcodes.append(IdsByCommand[type(com)])
+                for attr, label, kind in com.fields:
+                    value = getattr(com, attr)
+                    if kind.isString:
+                        refs.append(strings.setdefault(value, len(strings)))
+                    else:
+                        try:
+                            ints.append(value)
+                        except OverflowError:
+                            # Only u16s fit, but a command type added by
+                            # an engine fork might have bigger numbers
+                            return
+            lengths = array.array('I', map(len, strings))
+            if sys.byteorder == 'big':
+                ints.byteswap()
+                refs.byteswap()
+                lengths.byteswap()
+            table = ''.join(strings).encode('utf-8')
+            meta = self.meta(path)
+            header = self.Header.pack(self.Magic, self.Version, commandSchema(),
+                st.st_size, st.st_mtime_ns, contentHash, len(opcodes), len(ints),
+                len(refs), len(lengths), len(table), len(meta))
+            data = b''.join((header, meta, opcodes, ints.tobytes(), refs.tobytes(),
+                lengths.tobytes(), table))
+        else:
+            fields = list(self.Header.unpack_from(data))
+            fields[3], fields[4] = st.st_size, st.st_mtime_ns
+            data = self.Header.pack(*fields) + data[self.Header.size:]
+
+        os.makedirs(self.directory, exist_ok=True)
+        writeFileAtomically(self.entryPath(path), data)
+        self.evict()
+
+    def entries(self):
+        """
+        Return (path, size, last used time) for every cache file
+        """
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.name.endswith(self.Extension): continue
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((entry.path, st.st_size, st.st_mtime))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def evict(self):
+        """
+        Delete the least recently used cache files until they all fit in
+        maxBytes
+        """
+        entries = self.entries()
+        total = sum(size for path, size, used in entries)
+        for path, size, used in sorted(entries, key=lambda e: e[2]):
+            if total <= self.maxBytes: break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """
+        Delete every cache file. Returns how many there were.
+        """
+        entries = self.entries()
+        for path, size, used in entries:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return len(entries)
+
+
+
+################################################################
+################################################################
+################################################################
+########################### Timeline ###########################
+
+
+def formatFrames(frames):
+    """
+    Format a number of frames as m:ss.ff, where ff is the frame within
+    the second
+    """
+    seconds, frame = divmod(frames, FramesPerSecond)
+    minutes, seconds = divmod(seconds, 60)
+    return f'{minutes}:{seconds:02}.{frame:02}'
+
+
+class Timeline():
+    """
+    Index of the frame on which each command in a list runs. The
+    commands' durations are kept in a Fenwick tree, so looking up a
+    command's start frame, finding the command running at a frame and
+    changing one command's duration are all O(log n).
+
+    Call update(row) after changing a command's duration,
+    reorder(start, end) after moving commands around, and invalidate()
+    after inserting or removing commands.
+    """
+
+    # Commands that decide each part of stateAt()'s result
+    StateCommands = {
+        'text': (SetTextCommand,),
+        'textVisible': (ShowTextCommand, HideTextCommand),
+        'scene': (SwitchSceneCommand, SwitchSceneAndWaitCommand),
+        'titleVisible': (ShowTitleCommand, HideTitleCommand),
+        }
+
+    def __init__(self, commands):
+        self.commands = commands
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Mark the index as out of date, so that it's rebuilt the next
+        time it's used
+        """
+        self._tree = None
+
+    def _build(self):
+        """
+        Rebuild the index from self.commands in O(n)
+        """
+        coms = self.commands
+        n = len(coms)
+
+        self._durations = [com.duration for com in coms]
+        tree = [0] + self._durations
+        for i in range(1, n + 1):
+            j = i + (i & -i)
+            if j <= n: tree[j] += tree[i]
+        self._tree = tree
+        self._total = sum(self._durations)
+
+        # Rows of the commands that affect stateAt(), for bisecting. One
+        # pass over the commands finds all of them.
+        self._stateRows = {key: [] for key in self.StateCommands}
+        appendTo = {comType: self._stateRows[key].append
+            for key, types in self.StateCommands.items() for comType in types}
+        for i, comType in enumerate(map(type, coms)):
+            append = appendTo.get(comType)
+            if append is not None: append(i)
+        self._findFirstUntimed()
+
+    def _findFirstUntimed(self):
+        """
+        Find the first Switch Scene and Wait command, whose real length
+        isn't known
+        """
+        coms = self.commands
+        self._firstUntimed = next((row for row in self._stateRows['scene']
+            if type(coms[row]) is SwitchSceneAndWaitCommand), None)
+
+    def update(self, row):
+        """
+        Update the index after the duration of the command in the given
+        row may have changed. Returns True if it did change.
+        """
+        if self._tree is None: return True
+
+        delta = self.commands[row].duration - self._durations[row]
+        if not delta: return False
+        self._durations[row] += delta
+        self._total += delta
+
+        tree = self._tree
+        i = row + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+        return True
+
+    def reorder(self, start, end):
+        """
+        Update the index after the commands in rows start to end - 1
+        have been rearranged among themselves (by moving some of them),
+        in time proportional to end - start
+        """
+        if self._tree is None: return
+
+        coms = self.commands
+        durations = self._durations
+        durations[start:end] = [com.duration for com in coms[start:end]]
+
+        # Start frames outside of the rearranged rows stay the same, so
+        # only tree nodes that cover some of those rows need fixing. Each
+        # one is the difference of two start frames.
+        tree = self._tree
+        n = len(tree) - 1
+        outside = []
+        i = end
+        while True:
+            i += i & -i
+            if i > n or i - (i & -i) <= start: break
+            outside.append((i, self.startFrame(i)))
+
+        prefix = list(itertools.accumulate(itertools.chain((self.startFrame(start),), durations[start:end])))
+        for i in range(start + 1, end + 1):
+            low = i - (i & -i)
+            tree[i] = prefix[i - start] - (prefix[low - start] if low >= start else self.startFrame(low))
+        for i, frame in outside:
+            tree[i] = frame - prefix[i - (i & -i) - start]
+
+        for key, types in self.StateCommands.items():
+            rows = self._stateRows[key]
+            first = bisect.bisect_left(rows, start)
+            last = bisect.bisect_left(rows, end)
+            rows[first:last] = [i for i in range(start, end) if type(coms[i]) in types]
+        self._findFirstUntimed()
+
+    def startFrame(self, row):
+        """
+        Return the frame on which the command in the given row runs
+        """
+        if self._tree is None: self._build()
+
+        tree = self._tree
+        frame = 0
+        while row > 0:
+            frame += tree[row]
+            row -= row & -row
+        return frame
+
+    def totalFrames(self):
+        """
+        Return the number of frames the credits take
+        """
+        if self._tree is None: self._build()
+        return self._total
+
+    def isMinimum(self, row=None):
+        """
+        Return True if the command in the given row (or the end of the
+        credits, if row is None) may actually run later than the
+        timeline says, because a Switch Scene and Wait command before
+        it waits for a scene transition of unknown length
+        """
+        if self._tree is None: self._build()
+        if self._firstUntimed is None: return False
+        return row is None or row > self._firstUntimed
+
+    def rowAtFrame(self, frame):
+        """
+        Return the row of the last command that has run by the given
+        frame, or -1 if there are no commands
+        """
+        if self._tree is None: self._build()
+
+        # Find the largest k such that the first k durations add up to
+        # no more than frame -- that's the number of commands that run
+        # on or before it
+        tree = self._tree
+        n = len(tree) - 1
+        k = 0
+        step = 1 << n.bit_length()
+        while step:
+            if k + step <= n and tree[k + step] <= frame:
+                k += step
+                frame -= tree[k]
+            step >>= 1
+
+        return min(k, n - 1)
+
+    def stateAt(self, frame):
+        """
+        Return a dict describing the credits at the given frame: the
+        row of the last command that has run ('row'), the current Set
+        Text command ('text'), whether the text is visible
+        ('textVisible'), the scene ID ('scene') and whether the
+        titlescreen logo is visible ('titleVisible'). Values are None
+        if no command has set them yet.
+        """
+        row = self.rowAtFrame(frame)
+
+        def last(key):
+            rows = self._stateRows[key]
+            i = bisect.bisect_right(rows, row) - 1
+            return self.commands[rows[i]] if i >= 0 else None
+
+        text = last('text')
+        textVisible = last('textVisible')
+        scene = last('scene')
+        titleVisible = last('titleVisible')
+        return {
+            'row': row,
+            'text': text,
+            'textVisible': None if textVisible is None else isinstance(textVisible, ShowTextCommand),
+            'scene': None if scene is None else scene.scene,
+            'titleVisible': None if titleVisible is None else isinstance(titleVisible, ShowTitleCommand),
+            }
+
+
+
+################################################################
+################################################################
+################################################################
+############################ Search ############################
+
+
+class SearchIndex():
+    """
+    Inverted index of the words in the titles and text of a list of
+    commands' Set Text commands. Each query word matches any word that
+    starts with it, ignoring case, and a command has to match every
+    word in the query.
+
+    The index is built the first time it's searched. It refers to
+    commands rather than rows, so moving commands doesn't affect it;
+    call add(coms) after inserting commands, remove(coms) before
+    removing them, and update(com) after editing one.
+    """
+    WordPattern = re.compile(r'\w+')
+
+    def __init__(self, commands):
+        self.commands = commands
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Mark the index as out of date, so that it's rebuilt the next
+        time it's used
+        """
+        self._postings = None
+
+    def _build(self):
+        """
+        Rebuild the index from self.commands
+        """
+        self._postings = {} # word: set of commands
+        self._words = {} # command: its words
+        self._vocabulary = [] # every word, sorted
+        for com in self.commands:
+            self._add(com, False)
+        self._vocabulary = sorted(self._postings)
+
+    @classmethod
+    def wordsIn(cls, text):
+        """
+        Return the set of (casefolded) words in a string
+        """
+        return set(cls.WordPattern.findall(text.casefold()))
+
+    def _add(self, com, insort=True):
+        """
+        Add one command to the index
+        """
+        if not isinstance(com, SetTextCommand): return
+        words = self.wordsIn(f'{com.title}\n{com.text}')
+        self._words[com] = words
+        for word in words:
+            coms = self._postings.get(word)
+            if coms is None:
+                coms = self._postings[word] = set()
+                if insort: bisect.insort(self._vocabulary, word)
+            coms.add(com)
+
+    def _remove(self, com):
+        """
+        Remove one command from the index
+        """
+        for word in self._words.pop(com, ()):
+            coms = self._postings[word]
+            coms.discard(com)
+            if not coms:
+                del self._postings[word]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, word)]
+
+    def add(self, coms):
+        """
+        Update the index after inserting some commands
+        """
+        if self._postings is None: return
+        for com in coms: self._add(com)
+
+    def remove(self, coms):
+        """
+        Update the index before removing some commands
+        """
+        if self._postings is None: return
+        for com in coms: self._remove(com)
+
+    def update(self, com):
+        """
+        Update the index after a command's text may have changed
+        """
+        if self._postings is None: return
+        self._remove(com)
+        self._add(com)
+
+    def find(self, query):
+        """
+        Return the sorted rows of the commands matching a query, or
+        None if it doesn't have any words in it
+        """
+        terms = self.wordsIn(query)
+        if not terms: return None
+        if self._postings is None: self._build()
+
+        hits = None
+        for term in sorted(terms, key=len, reverse=True):
+            matches = set()
+            vocab = self._vocabulary
+            i = bisect.bisect_left(vocab, term)
+            while i < len(vocab) and vocab[i].startswith(term):
+                matches |= self._postings[vocab[i]]
+                i += 1
+            hits = matches if hits is None else hits & matches
+            if not hits: return []
+
+        return [row for row, com in enumerate(self.commands) if com in hits]
+
+
+class CommandTypeIndex():
+    """
+    Fuzzy index of the command types, for picking them by typing part
+    of their names. A query matches a name if its letters appear in it
+    in order, ignoring case and spaces ("shtx" matches Show Text), and
+    matches at the starts of words or in runs rank higher. Queries that
+    don't match any names are looked for in the descriptions instead,
+    with each word matching any word that starts with it.
+
+    Everything that doesn't depend on the query is worked out when the
+    index is made, since it's searched on every keystroke.
+    """
+    # A query for several commands separates them with any of these,
+    # and can end with "* count" to repeat them all
+    SequenceSeparator = re.compile(r'[,;>\u2192]')
+    RepeatPattern = re.compile(r'(.*?)\s*[*x\u00d7]\s*(\d+)\s*$', re.DOTALL)
+    MaxRepeat = 10000
+
+    # Scores for each matched letter
+    LetterScore = 1
+    WordStartScore = 3 # on top of LetterScore
+    RunScore = 3 # for following the previous matched letter
+
+    def __init__(self, types=None):
+        if types is None: types = CommandsById.values()
+
+        # (type, its name's letters, which of them start words, words
+        # in its description), in name order
+        self.entries = []
+        for cls in sorted(types, key=lambda cls: cls.name):
+            letters = []
+            starts = []
+            for word in SearchIndex.WordPattern.findall(cls.name.casefold()):
+                starts.append(len(letters))
+                letters.extend(word)
+            self.entries.append((cls, ''.join(letters), frozenset(starts),
+                sorted(SearchIndex.wordsIn(cls.description))))
+
+    @classmethod
+    def matchScore(cls, query, letters, starts):
+        """
+        Return the best score for matching the letters of a query, in
+        order, to the letters of a name, or None if they don't all
+        appear in it
+        """
+        # Quick check that they appear at all
+        it = iter(letters)
+        if not all(c in it for c in query): return None
+
+        # best[j] is the best score so far with the latest query letter
+        # matched to letters[j]
+        best = None
+        for i, q in enumerate(query):
+            new = [None] * len(letters)
+            before = None # best of best[:j]
+            for j, c in enumerate(letters):
+                if c == q:
+                    score = cls.LetterScore + (cls.WordStartScore if j in starts else 0)
+                    if i == 0:
+                        new[j] = score
+                    else:
+                        prev = before
+                        if j and best[j - 1] is not None and (prev is None or best[j - 1] + cls.RunScore > prev):
+                            prev = best[j - 1] + cls.RunScore
+                        if prev is not None: new[j] = prev + score
+                if best is not None and best[j] is not None and (before is None or best[j] > before):
+                    before = best[j]
+            best = new
+        return max((s for s in best if s is not None), default=None)
+
+    def find(self, query):
+        """
+        Return the command types matching a query, best first. Every type
+        matches an empty query.
+        """
+        letters = ''.join(SearchIndex.WordPattern.findall(query.casefold()))
+        if not letters: return [entry[0] for entry in self.entries]
+
+        scored = []
+        for n, (cls, name, starts, descWords) in enumerate(self.entries):
+            score = self.matchScore(letters, name, starts)
+            if score is not None:
+                # An exact name beats everything, then higher scores,
+                # then shorter names
+                scored.append((name != letters, -score, len(name), n, cls))
+        if scored:
+            return [item[-1] for item in sorted(scored)]
+
+        # Look in the descriptions
+        terms = SearchIndex.wordsIn(query)
+        return [cls for cls, name, starts, descWords in self.entries
+            if all(any(word.startswith(term) for word in descWords) for term in terms)]
+
+    def splitSequence(self, query):
+        """
+        Split a query for a sequence of commands, like
+        "set text, show, wait, hide * 3", into a list of queries for
+        each command and how many times to repeat the sequence. Empty
+        parts are kept, so the last part is always the one being typed.
+        """
+        count = 1
+        m = self.RepeatPattern.fullmatch(query)
+        if m:
+            query = m.group(1)
+            count = max(1, min(int(m.group(2)), self.MaxRepeat))
+        return [part.strip() for part in self.SequenceSeparator.split(query)], count
+
+
+
+################################################################
+################################################################
+################################################################
+############################# Lint #############################
+
+
+# Bits of the state lintCommands() keeps track of
+LintTextSet = 0x01 # a Set Text command has run
+LintTextVisible = 0x02
+LintTitleVisible = 0x04
+LintFireworks = 0x08
+LintEnded = 0x10 # End Credits has run
+LintEndReported = 0x20 # the first command after End Credits was flagged
+LintUnknown = 0xFF # placeholder for states that haven't been worked out
+
+# Commands that have to alternate in pairs: (whether it turns something
+# on, state bit, message if it's out of turn)
+LintPairs = {
+    ShowTextCommand: (True, LintTextVisible, 'Text is already showing'),
+    HideTextCommand: (False, LintTextVisible, 'Text is not showing'),
+    ShowTitleCommand: (True, LintTitleVisible, 'Titlescreen logo is already showing'),
+    HideTitleCommand: (False, LintTitleVisible, 'Titlescreen logo is not showing'),
+    BeginFireworksCommand: (True, LintFireworks, 'Fireworks are already going'),
+    EndFireworksCommand: (False, LintFireworks, 'Fireworks are not going'),
+    }
+
+
+def lintCommands(commands, states=None, dirty=None):
+    """
+    Check a list of commands for problems, in one pass. Returns a list
+    of (row, message) pairs, and a bytearray of the lint state before
+    each row that was checked and after the last one.
+
+    To check only part of a file again after it's been changed, pass
+    the commands from the first changed row on, the states from the
+    last check for those rows (the first of which has to be correct),
+    and the number of changed rows (dirty). Checking stops as soon as
+    it's past those and reaches a row whose state is the same as last
+    time, since nothing after that can have changed either.
+    """
+    if states is None: states = bytes((0,))
+    if dirty is None: dirty = len(commands)
+    state = states[0]
+    newStates = bytearray((state,))
+    issues = []
+
+    for row, com in enumerate(commands):
+        if row >= dirty and row < len(states) and states[row] == state:
+            break
+
+        if state & LintEnded:
+            if not state & LintEndReported:
+                issues.append((row, 'This and everything after it never run, because End Credits comes first'))
+                state |= LintEndReported
+            newStates.append(state)
+            continue
+
+        comType = type(com)
+        if comType in LintPairs:
+            on, bit, message = LintPairs[comType]
+            if bool(state & bit) == on: issues.append((row, message))
+            if comType is ShowTextCommand and not state & LintTextSet:
+                issues.append((row, 'No text has been set yet (add a Set Text command before this)'))
+            state = state | bit if on else state & ~bit
+        elif comType is SetTextCommand:
+            state |= LintTextSet
+            message = lintSetText(com)
+            if message: issues.append((row, message))
+        elif comType is EndCreditsCommand:
+            state |= LintEnded
+
+        newStates.append(state)
+
+    return issues, newStates
+
+
+def lintSetText(com):
+    """
+    Return a message about what would stop a Set Text command from being
+    saved properly, or None if nothing would
+    """
+    try:
+        title = com.encodeText(com.title, 'title')
+        text = com.encodeText(com.text, 'text')
+    except ValueError as e:
+        return str(e)
+
+    if len(title) + 1 > 0xFF:
+        return f'Set Text title is {len(title)} bytes long, but can be at most {0xFF - 1}'
+    lines = com.text.count('\n') + 1
+    if lines > 0xFF:
+        return f'Set Text text has {lines} lines, but can have at most {0xFF}'
+    if len(title) + len(text) + 6 > 0xFF:
+        return 'Set Text command is too long to be saved (shorten its title or text)'
+
+
+def lintFinalState(state):
+    """
+    Return messages about problems with the file as a whole, given the
+    state after its last command
+    """
+    messages = []
+    if not state & LintEnded:
+        messages.append('There is no End Credits command')
+    for on, off in ((ShowTextCommand, HideTextCommand),
+            (ShowTitleCommand, HideTitleCommand),
+            (BeginFireworksCommand, EndFireworksCommand)):
+        if state & LintPairs[on][1]:
+            messages.append(f'{on.name} is never followed by {off.name}')
+    return messages
+
+
+LintJob = collections.namedtuple('LintJob', 'results version start commands states dirty')
+
+
+class LintResults():
+    """
+    The problems found in a list of commands, kept up to date a region
+    at a time. Call inserted(), removed() and changed() as the list is
+    edited. nextJob() then returns a LintJob for the region that needs
+    checking again, to pass to lintCommands() -- it holds copies, so
+    that can be done in another thread -- and apply() stores the result.
+    """
+    def __init__(self, commands):
+        self.commands = commands
+        self.issues = {} # row: list of messages
+        self.fileIssues = [] # messages about the file as a whole
+        self.states = bytearray((0,)) + bytes((LintUnknown,)) * len(commands)
+        self.dirtyStart = self.dirtyEnd = None
+        self.version = 0 # changes whenever the commands do
+        self.changed(0, len(commands))
+
+    def changed(self, start, end):
+        """
+        Note that the commands in rows start to end - 1 have changed
+        """
+        if self.dirtyStart is None:
+            self.dirtyStart, self.dirtyEnd = start, end
+        else:
+            self.dirtyStart = min(self.dirtyStart, start)
+            self.dirtyEnd = max(self.dirtyEnd, end)
+        self.version += 1
+
+    def inserted(self, row, count):
+        """
+        Note that `count` commands have been inserted before the given
+        row
+        """
+        self.states[row + 1:row + 1] = bytes((LintUnknown,)) * count
+        self.issues = {r + count if r >= row else r: m for r, m in self.issues.items()}
+        if self.dirtyStart is not None:
+            if self.dirtyStart > row: self.dirtyStart += count
+            if self.dirtyEnd > row: self.dirtyEnd += count
+        self.changed(row, row + count)
+
+    def removed(self, row, count):
+        """
+        Note that `count` commands have been removed, starting at the
+        given row
+        """
+        # The state before the first removed row is still right, and is
+        # now the state before the row after them
+        del self.states[row + 1:row + count + 1]
+        self.issues = {r - count if r >= row + count else r: m
+            for r, m in self.issues.items() if not row <= r < row + count}
+        if self.dirtyStart is not None:
+            if self.dirtyStart > row: self.dirtyStart = max(row, self.dirtyStart - count)
+            if self.dirtyEnd > row: self.dirtyEnd = max(row, self.dirtyEnd - count)
+        self.changed(row, min(row + 1, len(self.commands)))
+
+    def nextJob(self):
+        """
+        Return a LintJob for the region that needs checking again, or
+        None if everything's up to date
+        """
+        if self.dirtyStart is None: return None
+        start = self.dirtyStart
+        return LintJob(self, self.version, start, self.commands[start:],
+            bytes(self.states[start:]), self.dirtyEnd - start)
+
+    def apply(self, job, result):
+        """
+        Store the result of running lintCommands() on a job. Returns the
+        range of rows whose problems may have changed, as (start, end),
+        or None if the commands have changed since the job was made (in
+        which case there's a new one to do).
+        """
+        if job.results is not self or job.version != self.version: return None
+
+        issues, states = result
+        start, end = job.start, job.start + len(states) - 1
+        self.states[start:end + 1] = states
+        self.issues = {r: m for r, m in self.issues.items() if not start <= r < end}
+        for row, message in issues:
+            self.issues.setdefault(start + row, []).append(message)
+        if end == len(self.commands):
+            self.fileIssues = lintFinalState(states[-1])
+        self.dirtyStart = self.dirtyEnd = None
+        return start, end
+
+    def count(self):
+        """
+        Return the total number of problems found
+        """
+        return sum(len(m) for m in self.issues.values()) + len(self.fileIssues)
+
+
+
+################################################################
+################################################################
+################################################################
+############################# Diff #############################
+
+
+# Above this many (old items * new items), a stretch of differences
+# without any anchors is shown as replaced wholesale instead of being
+# compared in detail with difflib, which would take too long
+DiffDetailLimit = 250000
+
+
+def describeCommand(com):
+    """
+    Return a one-line description of a command, like the editor shows
+    """
+    if com.dynamicDescription:
+        return f'{com.name} ({com.dynamicDescription})'
+    return com.name
+
+
+def describeChange(old, new):
+    """
+    Return a one-line description of how a command's values changed
+    """
+    changes = []
+    for attr, label, kind in new.fields:
+        a, b = getattr(old, attr), getattr(new, attr)
+        if a != b:
+            changes.append(f'{label.rstrip(":")} {a!r} -> {b!r}')
+    if not changes:
+        return f'{new.name}: same values, stored differently'
+    return f'{new.name}: ' + ', '.join(changes)
+
+
+def commandRecords(data):
+    """
+    Return the complete records (length byte, opcode and arguments) of
+    the commands in some raw file data, as bytes
+    """
+    view = memoryview(data).cast('B')
+    return [bytes(view[offset:offset + len(payload) + 2])
+        for opcode, offset, payload in iterCommands(view)]
+
+
+def commandFromRecord(record):
+    """
+    Create a command from one of the records commandRecords() returns
+    """
+    return CommandsById[record[1]].fromData(record[2:])
+
+
+def uniqueMatches(a, b, alo, ahi, blo, bhi):
+    """
+    Return (i, j) pairs where a[i] == b[j] and that item appears only
+    once in a[alo:ahi] and once in b[blo:bhi]. Of those, only the
+    longest run that's in the same order in both is returned, so they
+    can all be matched up at once.
+    """
+    counts = collections.Counter(a[alo:ahi])
+    positions = {}
+    for j in range(blo, bhi):
+        x = b[j]
+        if counts[x] == 1:
+            positions[x] = None if x in positions else j
+    pairs = [(i, positions[a[i]]) for i in range(alo, ahi)
+        if positions.get(a[i]) is not None]
+
+    # Longest increasing subsequence of the j's (patience sorting)
+    tails = [] # tails[n]: j of the last pair of the best run of length n + 1
+    tailIdx = []
+    previous = [None] * len(pairs)
+    for n, (i, j) in enumerate(pairs):
+        k = bisect.bisect_left(tails, j)
+        if k == len(tails):
+            tails.append(j)
+            tailIdx.append(n)
+        else:
+            tails[k] = j
+            tailIdx[k] = n
+        previous[n] = tailIdx[k - 1] if k else None
+
+    run = []
+    n = tailIdx[-1] if tailIdx else None
+    while n is not None:
+        run.append(pairs[n])
+        n = previous[n]
+    run.reverse()
+    return run
+
+
+def diffSequences(a, b):
+    """
+    Return the differences between two sequences of hashable items, as
+    the (tag, i1, i2, j1, j2) tuples difflib.SequenceMatcher's
+    get_opcodes() returns, minus the 'equal' ones.
+
+    Items that appear exactly once in each sequence are matched up
+    first (as in "patience diff"), which splits the rest into short
+    stretches that difflib can compare quickly. On its own, difflib
+    takes seconds on long sequences with lots of repeated items, which
+    is exactly what credits scripts are.
+    """
+    import difflib
+    ops = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        alo, ahi, blo, bhi = stack.pop()
+
+        # Skip whatever's the same at the start and end
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            alo += 1
+            blo += 1
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+
+        if alo == ahi and blo == bhi:
+            continue
+        elif alo == ahi:
+            ops.append(('insert', alo, ahi, blo, bhi))
+            continue
+        elif blo == bhi:
+            ops.append(('delete', alo, ahi, blo, bhi))
+            continue
+
+        anchors = uniqueMatches(a, b, alo, ahi, blo, bhi)
+        if anchors:
+            i, j = alo, blo
+            for ai, bj in anchors:
+                stack.append((i, ai, j, bj))
+                i, j = ai + 1, bj + 1
+            stack.append((i, ahi, j, bhi))
+        elif (ahi - alo) * (bhi - blo) <= DiffDetailLimit:
+            matcher = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi], autojunk=False)
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                if tag != 'equal':
+                    ops.append((tag, alo + i1, alo + i2, blo + j1, blo + j2))
+        else:
+            ops.append(('replace', alo, ahi, blo, bhi))
+
+    ops.sort(key=lambda op: (op[1], op[3]))
+    return ops
+
+
+def diffRecords(old, new):
+    """
+    Compare two lists of command records (see commandRecords()), and
+    return (row, message) pairs describing how to get from the old one
+    to the new one. Rows are positions in the new list.
+    """
+    import difflib
+    changes = []
+    for tag, i1, i2, j1, j2 in diffSequences(old, new):
+        oldComs = [commandFromRecord(r) for r in old[i1:i2]]
+        newComs = [commandFromRecord(r) for r in new[j1:j2]]
+
+        # Within a changed stretch, commands of the same type in the same
+        # place were edited, rather than removed and added again
+        oldTypes = [r[1] for r in old[i1:i2]]
+        newTypes = [r[1] for r in new[j1:j2]]
+        if oldTypes == newTypes:
+            typeOps = [('equal', 0, len(oldTypes), 0, len(newTypes))]
+        elif len(oldTypes) * len(newTypes) <= DiffDetailLimit:
+            typeOps = difflib.SequenceMatcher(None, oldTypes, newTypes, autojunk=False).get_opcodes()
+        else:
+            typeOps = [('replace', 0, len(oldTypes), 0, len(newTypes))]
+
+        for typeTag, ti1, ti2, tj1, tj2 in typeOps:
+            if typeTag == 'equal':
+                for k in range(ti2 - ti1):
+                    o, n = oldComs[ti1 + k], newComs[tj1 + k]
+                    if old[i1 + ti1 + k] != new[j1 + tj1 + k]:
+                        changes.append((j1 + tj1 + k, describeChange(o, n)))
+                continue
+            for o in oldComs[ti1:ti2]:
+                changes.append((j1 + tj1, f'removed {describeCommand(o)}'))
+            for k, n in enumerate(newComs[tj1:tj2]):
+                changes.append((j1 + tj1 + k, f'inserted {describeCommand(n)}'))
+
+    return changes
+
+
+################################################################
+################################################################
+################################################################
+########################## JSON Lines ##########################
+
+
+def commandAsDict(com):
+    """
+    Return a JSON-compatible dict describing a command
+    """
+    return {
+        'opcode': IdsByCommand[type(com)],
+        'type': type(com).__name__,
+        'fields': {attr: getattr(com, attr) for attr, label, kind in com.fields},
+        }
+
+
+def commandFromDict(d):
+    """
+    Create a command from a dict made by commandAsDict()
+    """
+    if not isinstance(d, dict):
+        raise ValueError(f'Expected an object, not {type(d).__name__}')
+    opcode = d.get('opcode')
+    if not isinstance(opcode, int) or isinstance(opcode, bool):
+        raise ValueError(f'opcode must be an integer, not {opcode!r}')
+    try:
+        comType = CommandsById[opcode]
+    except KeyError:
+        raise ValueError(f'Unknown opcode: {opcode}')
+    if 'type' in d and d['type'] != comType.__name__:
+        raise ValueError(f'Opcode {d["opcode"]} is {comType.__name__}, not {d["type"]}')
+
+    com = comType()
+    values = d.get('fields', {})
+    if not isinstance(values, dict):
+        raise ValueError(f'fields must be an object, not {type(values).__name__}')
+    unknown = values.keys() - {attr for attr, label, kind in comType.fields}
+    if unknown:
+        raise ValueError(f'{comType.__name__} has no field {sorted(unknown)[0]!r}')
+    for attr, label, kind in comType.fields:
+        if attr not in values: continue
+        value = values[attr]
+
+        if kind.isString:
+            if not isinstance(value, str):
+                raise ValueError(f'{comType.__name__}.{attr} must be a string')
+        elif (not isinstance(value, int) or isinstance(value, bool)
+                or not 0 <= value <= kind.maximum):
+            raise ValueError(f'{comType.__name__}.{attr} must be an integer from 0 to {kind.maximum}')
+
+        setattr(com, attr, value)
+
+    return com
+
+
+def dumpFile(inPath, outPath, cache=None):
+    """
+    Convert a StaffRoll.bin file to JSON Lines, one command per line.
+    Either path can be '-' for stdin/stdout. If a DiskCache is given,
+    the input file is loaded through it.
+    """
+    if cache is not None and inPath != '-':
+        coms = cache.load(inPath)
+    else:
+        data = sys.stdin.buffer.read() if inPath == '-' else mapFile(inPath)
+        coms = (CommandsById[opcode].fromData(payload) for opcode, offset, payload in iterCommands(data))
+
+    out = sys.stdout if outPath == '-' else open(outPath, 'w', encoding='utf-8')
+    try:
+        for com in coms:
+            out.write(json.dumps(commandAsDict(com), ensure_ascii=False))
+            out.write('\n')
+    except BaseException:
+        # Don't leave a partial file behind
+        if out is not sys.stdout:
+            out.close()
+            os.remove(outPath)
+        raise
+    finally:
+        if out is not sys.stdout: out.close()
+
+
+def buildFile(inPath, outPath):
+    """
+    Convert JSON Lines made by dumpFile() back to a StaffRoll.bin file.
+    Either path can be '-' for stdin/stdout. Commands are written the
+    way NewerStaffRollBin.save() writes them, so only files it saved
+    are rebuilt byte for byte (Set Text's line count, for one, is
+    recalculated rather than kept).
+    """
+    inp = sys.stdin if inPath == '-' else open(inPath, 'r', encoding='utf-8')
+    out = sys.stdout.buffer if outPath == '-' else open(outPath, 'wb')
+    try:
+        for lineNum, line in enumerate(inp, 1):
+            if not line.strip(): continue
+            try:
+                out.write(commandFromDict(json.loads(line)).asBytes())
+            except ValueError as e:
+                raise ValueError(f'{inPath}, line {lineNum}: {e}')
+        out.write(b'\x02\x00') # null command
+    except BaseException:
+        # Don't leave a partial file behind
+        if out is not sys.stdout.buffer:
+            out.close()
+            os.remove(outPath)
+        raise
+    finally:
+        if inp is not sys.stdin: inp.close()
+        if out is not sys.stdout.buffer: out.close()
+
+
+def diffFiles(oldPath, newPath):
+    """
+    Compare two StaffRoll.bin files command by command, and return a
+    list of messages describing the differences
+    """
+    old = commandRecords(mapFile(oldPath))
+    new = commandRecords(mapFile(newPath))
+    return [f'row {row}: {message}' for row, message in diffRecords(old, new)]
+
+
+def lintFile(path, cache=None):
+    """
+    Check a StaffRoll.bin file for problems, and return a list of
+    messages describing them. If a DiskCache is given, the file is
+    loaded through it.
+    """
+    commands = NewerStaffRollBin.fromFile(path).Commands if cache is None else cache.load(path)
+    issues, states = lintCommands(commands)
+    messages = [f'command {row} ({commands[row].name}): {message}' for row, message in issues]
+    return messages + lintFinalState(states[-1])
+
+
+def convertInProcess(func, inPath, outPath, encoding, cache=None):
+    """
+    Run dumpFile() or buildFile() in a worker process, which doesn't
+    necessarily share the parent's text encoding setting
+    """
+    setTextEncoding(encoding)
+    if cache is None: func(inPath, outPath)
+    else: func(inPath, outPath, cache)
+
+
+def batchConvert(mode, srcDir, dstDir, jobs=None, cache=None):
+    """
+    Run dumpFile() or buildFile() (depending on mode) over every
+    matching file in srcDir, in parallel, mirroring the folder
+    structure into dstDir. Returns a list of (path, error) for the
+    files that failed. If a DiskCache is given, files being dumped are
+    loaded through it.
+    """
+    func, inExt, outExt = {
+        'dump': (dumpFile, '.bin', '.jsonl'),
+        'build': (buildFile, '.jsonl', '.bin'),
+        }[mode]
+
+    tasks = []
+    for folder, subfolders, files in os.walk(srcDir):
+        for fn in files:
+            if not fn.lower().endswith(inExt): continue
+            inPath = os.path.join(folder, fn)
+            outPath = os.path.join(dstDir, os.path.relpath(inPath, srcDir))
+            outPath = outPath[:-len(inExt)] + outExt
+            os.makedirs(os.path.dirname(outPath), exist_ok=True)
+            tasks.append((inPath, outPath))
+
+    import concurrent.futures
+    errors = []
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        if mode != 'dump': cache = None
+        futures = {pool.submit(convertInProcess, func, i, o, TextEncoding, cache): i for i, o in tasks}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                errors.append((futures[future], e))
+    return errors
+
+
+
+################################################################
+################################################################
+################################################################
+############################ main() ############################
+
+
+def main(argv):
+    """
+    Command-line entry point for working with StaffRoll.bin files
+    without the editor
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog='staffroll.py',
+        description='Convert NewerSMBW StaffRoll.bin files to and from JSON Lines, check them for problems and compare them.')
+    parser.add_argument('--encoding', default=TextEncoding,
+        help=f'encoding of Set Text titles and text (default: {TextEncoding})')
+    parser.add_argument('--cache', action='store_true',
+        help="keep parsed .bin files in a cache on disk, so they're quicker to load next time (for dump and lint)")
+    parser.add_argument('--cache-dir', default=defaultCacheDir(),
+        help='folder to keep the cache in (default: %(default)s)')
+    parser.add_argument('--cache-size', type=int, default=256,
+        help='most space the cache can take up, in MB (default: %(default)s)')
+    sub = parser.add_subparsers(dest='action')
+    sub.required = True
+
+    p = sub.add_parser('dump', help='convert a .bin file to JSON Lines')
+    p.add_argument('input', help="input .bin file ('-' for stdin)")
+    p.add_argument('output', nargs='?', default='-', help="output .jsonl file ('-' for stdout)")
+
+    p = sub.add_parser('build', help='convert JSON Lines to a .bin file')
+    p.add_argument('input', help="input .jsonl file ('-' for stdin)")
+    p.add_argument('output', help="output .bin file ('-' for stdout)")
+
+    p = sub.add_parser('batch', help='convert every file in a folder')
+    p.add_argument('mode', choices=('dump', 'build'))
+    p.add_argument('source', help='folder to read files from')
+    p.add_argument('destination', help='folder to write converted files to')
+    p.add_argument('-j', '--jobs', type=int, help='number of processes to use (default: one per CPU)')
+
+    p = sub.add_parser('lint', help='check .bin files for problems')
+    p.add_argument('input', nargs='+', help='.bin files to check')
+
+    sub.add_parser('clear-cache', help='delete everything in the cache')
+
+    p = sub.add_parser('diff', help='show the commands that differ between two .bin files')
+    p.add_argument('old', help='original .bin file')
+    p.add_argument('new', help='changed .bin file')
+
+    args = parser.parse_args(argv[1:])
+
+    try:
+        setTextEncoding(args.encoding)
+    except LookupError:
+        parser.error(f'unknown encoding: {args.encoding}')
+
+    cache = None
+    if args.cache: cache = DiskCache(args.cache_dir, args.cache_size * 1024 * 1024)
+
+    try:
+        if args.action == 'dump':
+            dumpFile(args.input, args.output, cache)
+        elif args.action == 'build':
+            buildFile(args.input, args.output)
+        elif args.action == 'lint':
+            problems = False
+            for path in args.input:
+                for message in lintFile(path, cache):
+                    print(f'{path}: {message}')
+                    problems = True
+            if problems: return 1
+        elif args.action == 'diff':
+            changes = diffFiles(args.old, args.new)
+            for message in changes:
+                print(message)
+            if changes: return 1
+        elif args.action == 'clear-cache':
+            count = DiskCache(args.cache_dir).clear()
+            print(f'Deleted {count} cached file{"" if count == 1 else "s"} from {args.cache_dir}')
+        else:
+            errors = batchConvert(args.mode, args.source, args.destination, args.jobs, cache)
+            for path, e in sorted(errors, key=lambda x: x[0]):
+                print(f'{path}: {e}', file=sys.stderr)
+            if errors: return 1
+    except (OSError, ValueError, IndexError) as e:
+        print(f'staffroll.py: {e}', file=sys.stderr)
+        return 1
+
+    return 0
+
+if __name__ == '__main__': sys.exit(main(sys.argv))